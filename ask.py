@@ -5,6 +5,7 @@ Scrapes product data from Shopify sites via sitemap.xml and outputs in schema.or
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup
 import json
@@ -12,574 +13,2979 @@ import re
 import time
 import logging
 from urllib.parse import urljoin, urlparse
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
 import openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, Future
+import multiprocessing
 import threading
+import contextlib
+import queue
+import asyncio
+import hashlib
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import zlib
+import bisect
+import heapq
+import sqlite3
 import os
+from functools import cached_property
+from collections import Counter
+
+try:
+    import aiohttp
+except ImportError:  # Only required for the async engine
+    aiohttp = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # Optional fast parser backend
+    LexborHTMLParser = None
+
+try:
+    import lxml  # noqa: F401 - used by BeautifulSoup's 'lxml' builder
+    HAS_LXML = True
+except ImportError:  # Optional fast parser backend
+    HAS_LXML = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+SITEMAP_CHUNK_SIZE = 64 * 1024
+# Sub-sitemap filename keywords that never list products (Shopify: sitemap_pages_1.xml, ...)
+NON_PRODUCT_SITEMAPS = ('page', 'blog', 'article', 'collection')
+# Max items waiting between two crawl pipeline stages; full queues block the stage upstream
+PIPELINE_QUEUE_SIZE = 256
+# Consecutive /products/<handle>.js 404s after which the endpoint is treated as disabled
+PRODUCT_JS_MAX_MISSES = 5
+_STOP = object()  # end-of-stream marker passed through pipeline queues
+
+LLM_MODEL = "gpt-3.5-turbo"
+LLM_SYSTEM_PROMPT = "You are a data extraction expert. Extract comprehensive product information and return only valid JSON. Pay special attention to finding ALL product variants, their sizes, colors, prices, and IDs. Look for variant data in select elements, data attributes, JSON-LD, and JavaScript variables."
+PRODUCT_FIELDS_PROMPT = """\
+        - id: Numeric product ID (internal Shopify ID)
+        - gid: Global ID (gid://shopify/Product/...)
+        - vendor: Brand or manufacturer (should be "Down to Earth Project LLC" for this store)
+        - type: Product category/type
+        - price: Price in cents (e.g., 15000 = $150.00)
+        - name: Full product name with variant description
+        - description: Full product description text
+        - availability: Availability status (in stock, out of stock, pre-order, etc.)
+        - tags: Array of product tags/categories
+        - images: Array of image URLs (main product images)
+        - weight: Product weight if available
+        - dimensions: Product dimensions if available
+        - tax_info: Tax/VAT information if available
+        - reviews: Array of review objects with rating and text if available
+        - variants: Array of variant objects, each with:
+            - id: Variant ID (look for data-variant-id, variant_id, or similar attributes)
+            - name: Variant name (e.g., "L / Black", "Medium / Blue", etc.)
+            - sku: Stock Keeping Unit
+            - price: Price in cents
+            - availability: Availability status
+            - image: Image URL for the variant if available
+            - options: Object with size, color, etc. (e.g., {"size": "L", "color": "Black"})
+        
+        IMPORTANT: Look carefully for variant information in:
+        - <select> elements with size/color options
+        - data attributes like data-variant-id, data-option-value
+        - JSON-LD structured data
+        - JavaScript variables containing variant data
+        - Form elements with variant selections
+        
+"""
+
+# Fields the structured data extractor must fill for a page to skip the LLM
+REQUIRED_PRODUCT_FIELDS = ('id', 'name', 'price', 'variants')
+# Bump whenever the extraction prompt changes so cached responses are not reused
+PROMPT_VERSION = 1
+
+# Prompt packing for the LLM; token counts are estimated at ~4 characters per token
+LLM_TOKEN_BUDGET = 3000
+CHARS_PER_TOKEN = 4
+LLM_KEEP_SCRIPT_PATTERN = re.compile(
+    r'<script[^>]*(?:application/ld\+json|id=["\']ProductJson|data-product-json)[^>]*>.*?</script>',
+    re.DOTALL | re.IGNORECASE
+)
+LLM_DROP_BLOCK_PATTERN = re.compile(
+    r'<!--.*?-->|<(script|style|svg|noscript|nav|footer|header|iframe|template|head)\b[^>]*>.*?</\1\s*>',
+    re.DOTALL | re.IGNORECASE
+)
+LLM_DROP_TAG_PATTERN = re.compile(r'<(?:link|meta|base|source|input\s+type=["\']hidden["\'])\b[^>]*>', re.IGNORECASE)
+LLM_PRODUCT_SECTION_PATTERN = re.compile(
+    r'<main\b|id=["\']MainContent["\']|data-product-id|class=["\'][^"\']*\bproduct\b', re.IGNORECASE
+)
+LLM_TAG_PATTERN = re.compile(r'<([a-zA-Z][a-zA-Z0-9-]*)((?:\s[^<>]*?)?)(/?)>')
+LLM_ATTRIBUTE_PATTERN = re.compile(r'([a-zA-Z_:][-a-zA-Z0-9_:.]*)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s"\'>]+))?')
+# Attributes that carry product data; everything else (styling, tracking, aria) is dropped
+LLM_KEEP_ATTRIBUTES = {
+    'id', 'class', 'name', 'value', 'content', 'src', 'data-src', 'alt', 'selected', 'checked', 'disabled',
+    'data-product-id', 'data-variant-id', 'data-option-value', 'data-price', 'data-sku', 'data-product-description'
+}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting prompts."""
+    return len(text) // CHARS_PER_TOKEN
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Header written at the top of the output file
+SCHEMA_COMMENT = """/*
+Purpose: This file contains a normalized, AI-friendly list of Shopify products and their variants scraped from a store.
+It is designed to make it easy for an AI agent to search, filter, and select products and variants for purchase,
+without needing to scrape the site again.
+
+Schema Template:
+{
+  'products': [
+    {
+      'product_id': str, // Unique Shopify product ID
+      'name': str, // Product name
+      'description': str, // Product description
+      'brand': str, // Brand or vendor
+      'category': str, // Product category/type
+      'tags': [str], // List of tags/keywords
+      'url': str, // Product page URL
+      'image_urls': [str], // List of product image URLs
+      'price_cents': int, // Default price in cents
+      'availability': str, // Product-level availability
+      'variants': [
+        {
+          'variant_id': str, // Unique variant ID
+          'name': str, // Variant name (e.g., 'L / Black')
+          'sku': str, // SKU
+          'price_cents': int, // Price in cents
+          'availability': str, // Variant-level availability
+          'image_url': str, // Variant image URL
+          'options': {str: str} // Option name-value pairs (e.g., {'size': 'L', 'color': 'Black'})
+        }
+      ]
+    }
+  ]
+}
+
+Field Explanations:
+- product_id: Unique Shopify product ID (string or number as string)
+- name: Product name
+- description: Full product description
+- brand: Brand or vendor name
+- category: Product category/type (if available)
+- tags: List of tags/keywords (if available)
+- url: Product page URL
+- image_urls: List of product image URLs
+- price_cents: Default product price in cents (integer)
+- availability: Product-level availability (e.g., 'InStock', 'OutOfStock')
+- variants: List of variant objects, each with:
+    - variant_id: Unique variant ID
+    - name: Variant name (e.g., 'L / Black')
+    - sku: Stock Keeping Unit
+    - price_cents: Price in cents (integer)
+    - availability: Variant-level availability
+    - image_url: Variant image URL
+    - options: Dictionary of option name-value pairs (e.g., {'size': 'L', 'color': 'Black'})
+*/
+"""
+
+OUTPUT_FORMATS = ('txt', 'ndjson', 'sqlite')
+
+# JSON Schema of one normalized product, written next to NDJSON output
+PRODUCT_JSON_SCHEMA = {
+    '$schema': 'https://json-schema.org/draft/2020-12/schema',
+    'title': 'Product',
+    'description': 'One normalized Shopify product per line of the NDJSON output.',
+    'type': 'object',
+    'required': ['product_id', 'name', 'url', 'price_cents', 'availability', 'variants'],
+    'properties': {
+        'product_id': {'type': 'string', 'description': 'Unique Shopify product ID'},
+        'name': {'type': 'string', 'description': 'Product name'},
+        'description': {'type': 'string', 'description': 'Full product description'},
+        'brand': {'type': 'string', 'description': 'Brand or vendor name'},
+        'category': {'type': 'string', 'description': 'Product category/type (if available)'},
+        'tags': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Tags/keywords (if available)'},
+        'url': {'type': 'string', 'description': 'Product page URL'},
+        'image_urls': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Product image URLs'},
+        'price_cents': {'type': 'integer', 'description': 'Default product price in cents'},
+        'availability': {'type': 'string', 'description': 'Product-level schema.org availability URL'},
+        'variants': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'variant_id': {'type': 'string', 'description': 'Unique variant ID'},
+                    'name': {'type': 'string', 'description': "Variant name (e.g., 'L / Black')"},
+                    'sku': {'type': 'string', 'description': 'Stock Keeping Unit'},
+                    'price_cents': {'type': 'integer', 'description': 'Price in cents'},
+                    'availability': {'type': 'string', 'description': 'Variant-level schema.org availability URL'},
+                    'image_url': {'type': 'string', 'description': 'Variant image URL'},
+                    'options': {
+                        'type': 'object',
+                        'additionalProperties': {'type': 'string'},
+                        'description': "Option name-value pairs (e.g., {'size': 'L', 'color': 'Black'})"
+                    }
+                }
+            }
+        }
+    }
+}
+
+def schema_sidecar_path(path: str) -> str:
+    """Return the schema sidecar path for an NDJSON output file."""
+    return os.path.splitext(path)[0] + '.schema.json'
+
+def write_atomically(path: str, chunks: Iterator[str]):
+    """Write chunks to a temp file next to path, then rename it over path.
+    
+    Readers see either the old file or the complete new one, never a partial write.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+CATALOG_SCHEMA = """
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    product_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    category TEXT NOT NULL,
+    tags TEXT NOT NULL,          -- JSON array
+    url TEXT NOT NULL,
+    image_urls TEXT NOT NULL,    -- JSON array
+    price_cents INTEGER NOT NULL,
+    availability TEXT NOT NULL
+);
+CREATE TABLE variants (
+    id INTEGER PRIMARY KEY,
+    product_rowid INTEGER NOT NULL REFERENCES products(id),
+    variant_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    price_cents INTEGER NOT NULL,
+    availability TEXT NOT NULL,
+    image_url TEXT NOT NULL,
+    options TEXT NOT NULL        -- JSON object
+);
+"""
+
+# Built after the bulk insert, which is faster than maintaining them row by row
+CATALOG_INDEXES = """
+CREATE INDEX products_product_id ON products(product_id);
+CREATE INDEX products_price_cents ON products(price_cents);
+CREATE INDEX products_availability ON products(availability);
+CREATE INDEX products_brand ON products(brand);
+CREATE INDEX variants_product ON variants(product_rowid);
+CREATE INDEX variants_sku ON variants(sku);
+"""
+
+def write_sqlite_catalog(path: str, products: Iterator[Dict[str, Any]]):
+    """Write normalized products to a fresh SQLite catalog, replacing path atomically.
+    
+    Products and variants go into indexed tables, and name, description and
+    tags into the products_fts FTS5 index (rowid = products.id) when SQLite
+    was built with FTS5.
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(CATALOG_SCHEMA)
+        try:
+            conn.execute("CREATE VIRTUAL TABLE products_fts USING fts5(name, description, tags)")
+            has_fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite has no FTS5 support, skipping the full-text index: {e}")
+            has_fts = False
+        
+        for product in products:
+            cursor = conn.execute(
+                "INSERT INTO products (product_id, name, description, brand, category, tags, url, image_urls, "
+                "price_cents, availability) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (product['product_id'], product['name'], product['description'], product['brand'],
+                 product['category'], json.dumps(product['tags'], ensure_ascii=False), product['url'],
+                 json.dumps(product['image_urls'], ensure_ascii=False), product['price_cents'],
+                 product['availability'])
+            )
+            rowid = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO variants (product_rowid, variant_id, name, sku, price_cents, availability, image_url, "
+                "options) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(rowid, variant['variant_id'], variant['name'], variant['sku'], variant['price_cents'],
+                  variant['availability'], variant['image_url'], json.dumps(variant['options'], ensure_ascii=False))
+                 for variant in product['variants']]
+            )
+            if has_fts:
+                conn.execute(
+                    "INSERT INTO products_fts (rowid, name, description, tags) VALUES (?, ?, ?, ?)",
+                    (rowid, product['name'], product['description'], ' '.join(map(str, product['tags'])))
+                )
+        
+        conn.executescript(CATALOG_INDEXES)
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        conn.close()
+        os.unlink(tmp_path)
+        raise
+
+def read_sqlite_catalog(path: str) -> List[Dict[str, Any]]:
+    """Read the normalized products back from a catalog written by write_sqlite_catalog."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        variants = {}
+        for row in conn.execute(
+            "SELECT product_rowid, variant_id, name, sku, price_cents, availability, image_url, options "
+            "FROM variants ORDER BY id"
+        ):
+            variants.setdefault(row[0], []).append({
+                'variant_id': row[1], 'name': row[2], 'sku': row[3], 'price_cents': row[4],
+                'availability': row[5], 'image_url': row[6], 'options': json.loads(row[7])
+            })
+        return [
+            {'product_id': row[1], 'name': row[2], 'description': row[3], 'brand': row[4], 'category': row[5],
+             'tags': json.loads(row[6]), 'url': row[7], 'image_urls': json.loads(row[8]), 'price_cents': row[9],
+             'availability': row[10], 'variants': variants.get(row[0], [])}
+            for row in conn.execute(
+                "SELECT id, product_id, name, description, brand, category, tags, url, image_urls, "
+                "price_cents, availability FROM products ORDER BY id"
+            )
+        ]
+    finally:
+        conn.close()
+
+# HTTP statuses worth retrying: throttling and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Floor for a host's rate after repeated 429s, in requests/second
+MIN_RATE_LIMIT = 0.5
+# Share of the configured rate won back per successful request after a 429
+RATE_RECOVERY_STEP = 0.02
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose per-host pool fits the scraper's concurrency and that counts connection reuse.
+    
+    requests' default adapter keeps 10 connections per host; with more workers
+    than that, surplus connections are discarded after each response and the
+    next request pays a new TCP/TLS handshake.
+    """
+    
+    def __init__(self, pool_size: int, max_hosts: int = 10):
+        self._lock = threading.Lock()
+        self._retired_requests = 0
+        self._retired_connections = 0
+        super().__init__(pool_connections=max_hosts, pool_maxsize=pool_size)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # Keep the counters of host pools evicted from the manager
+        self.poolmanager.pools.dispose_func = self._retire_pool
+    
+    def _retire_pool(self, pool):
+        with self._lock:
+            self._retired_requests += pool.num_requests
+            self._retired_connections += pool.num_connections
+        pool.close()
+    
+    def connection_counts(self) -> Tuple[int, int]:
+        """Return (requests sent, connections opened) over the adapter's lifetime."""
+        with self._lock:
+            requests_sent, opened = self._retired_requests, self._retired_connections
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                opened += pool.num_connections
+        return requests_sent, opened
+
+class HostRateLimiter:
+    """Token bucket rate limiter keyed by host and shared by every worker.
+    
+    Without a configured rate, hosts are unlimited until they answer 429; the
+    host is then limited to half the request rate it was seeing, and the
+    limit is lifted again as requests succeed.
+    """
+    
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """rate is in requests/second per host; 0 or less means no fixed limit."""
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._buckets = {}  # host -> (tokens, last refill time)
+        self._rates = {}  # host -> rate lowered by back_off
+        self._ceilings = {}  # host -> rate that recover() climbs back to
+        self._observed = {}  # host -> (window start, requests in window, last measured rate)
+        self._paused_until = {}  # host -> monotonic time set by back_off
+        self._lock = threading.Lock()
+    
+    def _reserve(self, url: str) -> float:
+        """Take a token for the URL's host and return how long to wait before using it."""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            pause = max(0.0, self._paused_until.get(host, 0.0) - now)
+            start, count, measured = self._observed.get(host, (now, 0, 0.0))
+            if now - start >= 1.0:
+                start, count, measured = now, 0, count / (now - start)
+            self._observed[host] = (start, count + 1, measured)
+            rate = self._rates.get(host, self.rate)
+            if rate <= 0:
+                return pause
+            capacity = self.capacity if self.rate > 0 else max(1.0, rate)
+            tokens, last = self._buckets.get(host, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate) - 1
+            self._buckets[host] = (tokens, now)
+        # A negative balance is a reservation further down the queue
+        return max(pause, -tokens / rate if tokens < 0 else 0.0)
+    
+    def acquire(self, url: str):
+        """Block until a request to the URL's host is allowed."""
+        wait = self._reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+    
+    async def acquire_async(self, url: str):
+        """Async version of acquire."""
+        wait = self._reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    def back_off(self, url: str, delay: float):
+        """After a 429, pause every worker's requests to the host for delay seconds and halve its rate.
+        
+        The rate creeps back up through recover() as requests succeed again.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            # 429s arriving while the host is already paused belong to the same overload
+            already_paused = self._paused_until.get(host, 0.0) > now
+            self._paused_until[host] = max(self._paused_until.get(host, 0.0), now + delay)
+            if already_paused:
+                return
+            current = self._rates.get(host, self.rate)
+            if current <= 0:
+                # No limit yet: start from the rate the host was actually getting
+                start, count, measured = self._observed.get(host, (now, 0, 0.0))
+                current = max(measured, count / max(now - start, 1.0))
+                self._ceilings[host] = current
+                self._buckets.pop(host, None)
+            rate = max(MIN_RATE_LIMIT, current / 2)
+            self._rates[host] = rate
+            logger.warning(f"Throttled by {host}, lowering the rate limit to {rate:g} requests/second")
+    
+    def recover(self, url: str):
+        """Raise a backed-off host's rate a small step after a successful request, up to its ceiling.
+        
+        The ceiling is the configured rate, or without one the rate seen at the
+        first 429; reaching it lifts the limit.
+        """
+        if not self._rates:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            if host in self._rates:
+                ceiling = self.rate if self.rate > 0 else self._ceilings[host]
+                rate = self._rates[host] + ceiling * RATE_RECOVERY_STEP
+                if rate >= ceiling:
+                    del self._rates[host]
+                    self._ceilings.pop(host, None)
+                    self._buckets.pop(host, None)
+                else:
+                    self._rates[host] = rate
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter, bounded by a retry budget shared by the whole run."""
+    
+    def __init__(self, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 60.0, budget: int = 1000):
+        """max_retries is per request; budget caps the total number of retries in the run."""
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Parse a Retry-After header given in seconds or as an HTTP date."""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+    
+    def next_delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """Return the wait before retrying a request that failed attempt + 1 times, or None to give up."""
+        if attempt >= self.max_retries:
+            return None
+        with self._lock:
+            if self.budget <= 0:
+                return None
+            self.budget -= 1
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        # The server knows best when it will accept requests again
+        return max(delay, retry_after) if retry_after is not None else delay
+
+class AIMDController:
+    """Adaptive cap on in-flight store requests: additive increase while healthy, multiplicative decrease on trouble.
+    
+    Every request reports its time to response headers, its status and its
+    kind (sitemap, product JSON or page). Throttling (429), server errors,
+    connection failures and latency climbing well above the best seen for the
+    same kind cut the limit; healthy responses grow it by about one per round trip.
+    """
+    
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 64,
+                 decrease: float = 0.5, latency_factor: float = 2.0, latency_slack: float = 0.05):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.latency_slack = latency_slack  # seconds of jitter never treated as congestion
+        self.in_flight = 0
+        self.decreases = 0
+        # Per request kind, since a tiny .js response and a rendered page have different baselines
+        self._latency = {}       # kind -> EWMA of response latency
+        self._best_latency = {}  # kind -> lowest EWMA seen, the uncongested baseline
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # futures of coroutines waiting for a slot
+    
+    def acquire(self):
+        """Block until a request slot is free."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+    
+    async def acquire_async(self):
+        """Async version of acquire, for the event loop thread."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._async_waiters.append(waiter)
+            await waiter
+        self.in_flight += 1
+    
+    def release(self, latency: float, status: Optional[int], kind: str = 'page'):
+        """Free a slot and adjust the limit; status is None when the request failed without a response."""
+        with self._cond:
+            self.in_flight -= 1
+            previous = self._latency.get(kind)
+            average = latency if previous is None else 0.8 * previous + 0.2 * latency
+            self._latency[kind] = average
+            best = self._best_latency[kind] = min(self._best_latency.get(kind, average), average)
+            congested = average > best * self.latency_factor + self.latency_slack
+            if status is None or status == 429 or status >= 500 or congested:
+                now = time.monotonic()
+                # Cut at most once per round trip, so one overload is not punished repeatedly
+                if now - self._last_decrease > average:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self.decreases += 1
+                    logger.debug(f"Concurrency limit lowered to {int(self.limit)} "
+                                 f"(status {status}, {kind} latency {average:.2f}s)")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+class LLMCache:
+    """Persistent SQLite cache of LLM responses with a size cap and LRU eviction."""
+    
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        """Open (or create) the cache database at path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Hash the inputs that determine an LLM response."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+    
+    def put(self, key: str, response: str):
+        """Store a response, evicting least recently used entries over the size cap."""
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._total_bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                oldest = self._conn.execute(
+                    "SELECT key, size FROM llm_cache ORDER BY last_used LIMIT 100"
+                ).fetchall()
+                if not oldest:
+                    break
+                for old_key, old_size in oldest:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                    self._total_bytes -= old_size
+                    if self._total_bytes <= self.max_bytes:
+                        break
+            self._conn.commit()
+    
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._conn.close()
+
+class HTTPCache:
+    """Persistent SQLite cache of zlib-compressed response bodies with their ETag/Last-Modified validators.
+    
+    Alongside each page it keeps the product record last extracted from it, so
+    a 304 Not Modified can skip extraction entirely. Like LLMCache it has a
+    size cap with LRU eviction.
+    """
+    
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        """Open (or create) the cache database at path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB NOT NULL, record TEXT, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    
+    @staticmethod
+    def validators(headers: Any) -> Tuple[Optional[str], Optional[str]]:
+        """Return the (ETag, Last-Modified) response headers."""
+        return headers.get('ETag'), headers.get('Last-Modified')
+    
+    @staticmethod
+    def request_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """Conditional request headers that revalidate a cached entry."""
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    @staticmethod
+    def iter_body(body: bytes, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Decompress a cached body incrementally."""
+        decompressor = zlib.decompressobj()
+        for i in range(0, len(body), chunk_size):
+            chunk = decompressor.decompress(body[i:i + chunk_size])
+            if chunk:
+                yield chunk
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+    
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return {'etag', 'last_modified', 'body' (compressed), 'record'} for url, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, body, record FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        return {'etag': row[0], 'last_modified': row[1], 'body': row[2],
+                'record': json.loads(row[3]) if row[3] else None}
+    
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], body: bytes):
+        """Store an already zlib-compressed body; any record from an older version of the page is dropped."""
+        with self._lock:
+            self._forget_size(url)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, body, record, size, last_used) "
+                "VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (url, etag, last_modified, body, len(body), time.time())
+            )
+            self._total_bytes += len(body)
+            self._evict()
+            self._conn.commit()
+    
+    def put_record(self, url: str, record: Dict[str, Any]):
+        """Attach the product record extracted from the cached page at url."""
+        record_json = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            row = self._conn.execute("SELECT length(body) FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+            size = row[0] + len(record_json.encode('utf-8'))
+            self._forget_size(url)
+            self._conn.execute("UPDATE responses SET record = ?, size = ? WHERE url = ?", (record_json, size, url))
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+    
+    def _forget_size(self, url: str):
+        old = self._conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+        if old:
+            self._total_bytes -= old[0]
+    
+    def _evict(self):
+        """Delete least recently used entries until the cache fits max_bytes."""
+        while self._total_bytes > self.max_bytes:
+            oldest = self._conn.execute(
+                "SELECT url, size FROM responses ORDER BY last_used LIMIT 100"
+            ).fetchall()
+            if not oldest:
+                break
+            for old_url, old_size in oldest:
+                self._conn.execute("DELETE FROM responses WHERE url = ?", (old_url,))
+                self._total_bytes -= old_size
+                if self._total_bytes <= self.max_bytes:
+                    break
+    
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._conn.close()
+
+class SoupParserBackend:
+    """BeautifulSoup with either the pure-Python html.parser or the C-backed lxml builder."""
+    
+    def __init__(self, features: str = 'html.parser'):
+        self.name = features
+        self.features = features
+    
+    def parse(self, html_content: str) -> Any:
+        return BeautifulSoup(html_content, self.features)
+    
+    def select(self, doc: Any, selector: str) -> list:
+        return doc.select(selector)
+    
+    def select_one(self, doc: Any, selector: str) -> Any:
+        return doc.select_one(selector)
+    
+    def attr(self, node: Any, name: str) -> Optional[str]:
+        return node.get(name)
+    
+    def text(self, node: Any) -> str:
+        return node.get_text()
+    
+    def string(self, node: Any) -> Optional[str]:
+        return node.string
+
+# Elements whose contents are not page text
+TEXTLESS_TAGS = ['script', 'style', 'template']
+
+class SelectolaxParserBackend:
+    """selectolax (lexbor) parser, the fastest option for large theme pages."""
+    
+    name = 'selectolax'
+    
+    def parse(self, html_content: str) -> Any:
+        return LexborHTMLParser(html_content)
+    
+    def select(self, doc: Any, selector: str) -> list:
+        return doc.css(selector)
+    
+    def select_one(self, doc: Any, selector: str) -> Any:
+        return doc.css_first(selector)
+    
+    def attr(self, node: Any, name: str) -> Optional[str]:
+        return node.attributes.get(name)
+    
+    def text(self, node: Any) -> str:
+        # BeautifulSoup's get_text() leaves out script/style/template contents; text() keeps them
+        if node.css_first(', '.join(TEXTLESS_TAGS)) is None:
+            return node.text()
+        node = node.clone()
+        node.strip_tags(TEXTLESS_TAGS)
+        return node.text()
+    
+    def string(self, node: Any) -> Optional[str]:
+        return node.text()
+
+PARSER_CHOICES = ['auto', 'selectolax', 'lxml', 'html.parser']
+
+def get_parser_backend(name: str = 'auto'):
+    """Return the HTML parser backend for name; 'auto' picks the fastest one installed."""
+    if name == 'auto':
+        name = 'selectolax' if LexborHTMLParser else 'lxml' if HAS_LXML else 'html.parser'
+    if name == 'selectolax':
+        if LexborHTMLParser is None:
+            raise ImportError("The selectolax parser requires selectolax (pip install selectolax)")
+        return SelectolaxParserBackend()
+    if name == 'lxml':
+        if not HAS_LXML:
+            raise ImportError("The lxml parser requires lxml (pip install lxml)")
+        return SoupParserBackend('lxml')
+    if name == 'html.parser':
+        return SoupParserBackend('html.parser')
+    raise ValueError(f"Unknown parser: {name}")
+
+class SitemapStreamParser:
+    """Incremental sitemap parser that returns <url>/<sitemap> entries as their closing tags arrive.
+    
+    Processed elements are dropped from the tree, so memory stays bounded no
+    matter how many entries (or image extensions) the sitemap holds. Elements
+    are matched by local name, which covers every sitemap namespace variant.
+    """
+    
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root = None
+    
+    def feed(self, chunk: bytes) -> List[Tuple[str, str, Optional[str]]]:
+        """Parse the next chunk and return completed (tag, loc, lastmod) entries."""
+        self._parser.feed(chunk)
+        return self._drain()
+    
+    def close(self) -> List[Tuple[str, str, Optional[str]]]:
+        """Finish parsing and return any remaining entries."""
+        self._parser.close()
+        return self._drain()
+    
+    def _drain(self) -> List[Tuple[str, str, Optional[str]]]:
+        entries = []
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = elem
+                continue
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if tag not in ('url', 'sitemap'):
+                continue
+            loc = lastmod = None
+            for child in elem:
+                child_tag = child.tag.rsplit('}', 1)[-1]
+                if child_tag == 'loc' and child.text:
+                    loc = child.text.strip()
+                elif child_tag == 'lastmod' and child.text:
+                    lastmod = child.text.strip()
+            if loc:
+                entries.append((tag, loc, lastmod))
+            self._root.clear()
+        return entries
+
+class CrawlState:
+    """Persistent per-store crawl state: URL -> sitemap lastmod, content hash and last extracted record."""
+    
+    def __init__(self, path: str):
+        """Open (or create) the state database at path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, lastmod TEXT, content_hash TEXT, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+    
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return {'lastmod', 'content_hash', 'record'} for url, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lastmod, content_hash, record FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'lastmod': row[0], 'content_hash': row[1], 'record': json.loads(row[2])}
+    
+    def put(self, url: str, lastmod: Optional[str], content_hash: Optional[str], record: Dict[str, Any]):
+        """Store the latest extraction for url."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, lastmod, content_hash, record, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (url, lastmod, content_hash, json.dumps(record, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+    
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._conn.close()
+
+class CheckpointLog:
+    """Append-only NDJSON log of finished product records, so an interrupted crawl can resume."""
+    
+    def __init__(self, path: str, resume: bool = False):
+        """Open the log at path; resume keeps and loads existing records, otherwise it starts empty."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.completed = {}  # product URL -> record
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+    
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line torn by a crash mid-write
+            if isinstance(record, dict) and record.get('url'):
+                self.completed[record['url']] = record
+        if data and not data.endswith(b'\n'):
+            # Terminate a torn last line so the next append starts cleanly
+            with open(self.path, 'ab') as f:
+                f.write(b'\n')
+    
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return the checkpointed record for url, or None."""
+        return self.completed.get(url)
+    
+    def append(self, record: Dict[str, Any]):
+        """Durably record a finished product, unless its URL is already in the log."""
+        url = record.get('url')
+        with self._lock:
+            if not url or url in self.completed:
+                return
+            self.completed[url] = record
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+    
+    def close(self):
+        """Flush and close the log."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+class ProductPage:
+    """A product page parsed exactly once, with the shared selector lookups cached."""
+    
+    NAME_SELECTORS = [
+        'h1.product-single__title',
+        '.product__title h1',
+        'h1[data-product-title]',
+        'h1'
+    ]
+    PRICE_SELECTORS = [
+        '.price__regular .price-item--regular',
+        '.product__price .price-item--regular',
+        '[data-price]',
+        '.price'
+    ]
+    IMAGE_SELECTORS = [
+        '.product__media img',
+        '.product-single__photo img',
+        '.product__image img',
+        'img[data-src]',
+        'img[src*="cdn.shopify.com"]'
+    ]
+    DESCRIPTION_SELECTORS = [
+        '.product__description',
+        '.product-single__description',
+        '[data-product-description]',
+        '.rte'
+    ]
+    PRODUCT_ID_SELECTORS = [
+        '[data-product-id]',
+        '.product-single__meta [data-product-id]',
+        'script[type="application/ld+json"]'
+    ]
+    
+    JSON_LD_PATTERN = re.compile(
+        r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE
+    )
+    PRODUCT_JSON_PATTERN = re.compile(
+        r'<script[^>]*(?:id=["\']ProductJson[^"\']*["\']|data-product-json)[^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE
+    )
+    SHOPIFY_META_PATTERN = re.compile(r'var\s+meta\s*=\s*')
+    OPTION_NAME_PATTERN = re.compile(r'name=["\']options\[([^\]"\']+)\]["\']')
+    
+    def __init__(self, html_content: str, url: str, backend: Any = None):
+        self.html = html_content
+        self.url = url
+        self.backend = backend or SoupParserBackend()
+    
+    # Selector lookups read by the LLM fallbacks
+    FALLBACK_FIELDS = ('name', 'price', 'images', 'description', 'product_id')
+    
+    @classmethod
+    def from_fields(cls, html_content: str, url: str, fields: Dict[str, Any], backend: Any = None) -> 'ProductPage':
+        """Rebuild a page whose lookups were already computed, e.g. in a parse worker process."""
+        page = cls(html_content, url, backend)
+        page.__dict__.update(fields)  # pre-fills the cached properties
+        return page
+    
+    def fallback_fields(self) -> Dict[str, Any]:
+        """Compute the fallback lookups eagerly so they can be shipped to another process."""
+        return {field: getattr(self, field) for field in self.FALLBACK_FIELDS}
+    
+    @cached_property
+    def doc(self) -> Any:
+        """The parsed document, built on first use."""
+        return self.backend.parse(self.html)
+    
+    # Structured data is read from the raw HTML with regexes, so pages that carry
+    # it never pay for building a document tree.
+    
+    @cached_property
+    def json_ld_product(self) -> Optional[Dict[str, Any]]:
+        """The first schema.org Product (or ProductGroup) object embedded as JSON-LD."""
+        for match in self.JSON_LD_PATTERN.finditer(self.html):
+            try:
+                data = json.loads(match.group(1))
+            except ValueError:
+                continue
+            candidates = data if isinstance(data, list) else [data]
+            for candidate in list(candidates):
+                if isinstance(candidate, dict) and isinstance(candidate.get('@graph'), list):
+                    candidates.extend(candidate['@graph'])
+            for candidate in candidates:
+                if not isinstance(candidate, dict):
+                    continue
+                types = candidate.get('@type')
+                types = types if isinstance(types, list) else [types]
+                if 'Product' in types or 'ProductGroup' in types:
+                    return candidate
+        return None
+    
+    @cached_property
+    def shopify_meta(self) -> Optional[Dict[str, Any]]:
+        """The ShopifyAnalytics `var meta = {...}` object."""
+        match = self.SHOPIFY_META_PATTERN.search(self.html)
+        if not match:
+            return None
+        try:
+            meta, _ = json.JSONDecoder().raw_decode(self.html, match.end())
+        except ValueError:
+            return None
+        return meta if isinstance(meta, dict) else None
+    
+    @cached_property
+    def product_json(self) -> Optional[Dict[str, Any]]:
+        """The theme's embedded product JSON (same shape as /products/<handle>.js)."""
+        for match in self.PRODUCT_JSON_PATTERN.finditer(self.html):
+            try:
+                data = json.loads(match.group(1))
+            except ValueError:
+                continue
+            if isinstance(data, dict) and data.get('variants'):
+                return data
+        return None
+    
+    @cached_property
+    def option_names(self) -> List[str]:
+        """Variant option names from the product form's options[...] inputs."""
+        return list(dict.fromkeys(name.lower() for name in self.OPTION_NAME_PATTERN.findall(self.html)))
+    
+    @cached_property
+    def name(self) -> str:
+        """Product title from the page heading."""
+        for selector in self.NAME_SELECTORS:
+            name_elem = self.backend.select_one(self.doc, selector)
+            if name_elem is not None:
+                return self.backend.text(name_elem).strip()
+        return ''
+    
+    @cached_property
+    def price(self) -> int:
+        """Displayed price in cents, or 0 if none was found."""
+        for selector in self.PRICE_SELECTORS:
+            price_elem = self.backend.select_one(self.doc, selector)
+            if price_elem is not None:
+                price_text = self.backend.text(price_elem).strip()
+                price_match = re.search(r'\$?(\d+\.?\d*)', price_text)
+                if price_match:
+                    price = float(price_match.group(1))
+                    return int(price * 100)  # Convert to cents
+        return 0
+    
+    @cached_property
+    def images(self) -> List[str]:
+        """Shopify CDN product image URLs."""
+        images = []
+        for selector in self.IMAGE_SELECTORS:
+            for img in self.backend.select(self.doc, selector):
+                src = self.backend.attr(img, 'src') or self.backend.attr(img, 'data-src')
+                if src and 'cdn.shopify.com' in src:
+                    if not src.startswith('http'):
+                        src = 'https:' + src if src.startswith('//') else 'https://' + src
+                    images.append(src)
+            if images:
+                break
+        return images
+    
+    @cached_property
+    def description(self) -> str:
+        """Product description text."""
+        for selector in self.DESCRIPTION_SELECTORS:
+            desc_elem = self.backend.select_one(self.doc, selector)
+            if desc_elem is not None:
+                return self.backend.text(desc_elem).strip()
+        return ''
+    
+    @cached_property
+    def product_id(self) -> Optional[str]:
+        """Product ID from data-product-id attributes or JSON-LD."""
+        for selector in self.PRODUCT_ID_SELECTORS:
+            for element in self.backend.select(self.doc, selector):
+                string = self.backend.string(element)
+                if self.backend.attr(element, 'data-product-id'):
+                    return self.backend.attr(element, 'data-product-id')
+                elif string and '"@type":"Product"' in string:
+                    # Try to extract from JSON-LD
+                    try:
+                        json_data = json.loads(string)
+                        if isinstance(json_data, dict) and json_data.get('@type') == 'Product':
+                            if json_data.get('@id'):
+                                return json_data['@id'].split('/')[-1]
+                    except:
+                        pass
+        return None
+
+class LLMBatcher:
+    """Groups LLM extraction requests from concurrent workers into multi-product calls.
+    
+    Workers submit trimmed pages and get a Future for the response text. A
+    background thread flushes a batch when it is full or max_wait seconds after
+    its first item arrived; batches are sent on a small pool of threads.
+    """
+    
+    def __init__(self, send_batch, send_single, batch_size: int, max_wait: float = 0.5, max_concurrency: int = 4):
+        """send_batch(items) returns one response text (or None) per item; send_single(item) retries one item."""
+        self.send_batch = send_batch
+        self.send_single = send_single
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._first_pending_at = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def submit(self, trimmed_html: str, url: str) -> Future:
+        """Queue a page for extraction."""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("LLMBatcher is closed")
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.append((trimmed_html, url, future))
+            self._condition.notify()
+        return future
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if len(self._pending) >= self.batch_size or (self._closed and self._pending):
+                        break
+                    if self._closed:
+                        return
+                    if self._pending:
+                        remaining = self._first_pending_at + self.max_wait - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+                batch = self._pending[:self.batch_size]
+                self._pending = self._pending[self.batch_size:]
+                self._first_pending_at = time.monotonic() if self._pending else None
+            self._executor.submit(self._send, batch)
+    
+    def close(self):
+        """Flush queued items, then stop the background thread and the sender pool."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+    
+    def _send(self, batch: list):
+        items = [(trimmed_html, url) for trimmed_html, url, _ in batch]
+        try:
+            results = self.send_batch(items) if len(items) > 1 else [None]
+        except Exception as e:
+            logger.warning(f"Batched LLM call for {len(items)} products failed, retrying individually: {e}")
+            results = [None] * len(items)
+        
+        for item, (_, _, future), result in zip(items, batch, results):
+            if result is None:
+                # Retry failures on their own so one bad item cannot sink the batch
+                try:
+                    result = self.send_single(item)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            future.set_result(result)
+
+# Per-process parser backend for the parse process pool, set once by _init_parse_worker
+_parse_backend = None
+
+def _init_parse_worker(parser: str):
+    """Process pool initializer: build the parser backend once per worker process."""
+    global _parse_backend
+    _parse_backend = get_parser_backend(parser)
+
+def _parse_page_in_worker(content: bytes, url: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Structured extraction for one page, run in a parse worker process.
+    
+    Returns the structured record and, when the LLM is still needed, the
+    page's fallback lookups so the parent never re-parses the page.
+    """
+    page = ProductPage(content.decode('utf-8', errors='replace'), url, _parse_backend)
+    # Static extraction helpers, so workers need no scraper instance (or its HTTP/OpenAI clients)
+    structured = ShopifyScraper.extract_structured_data(page)
+    if not ShopifyScraper._missing_product_fields(structured):
+        return structured, None
+    return structured, page.fallback_fields()
+
+def start_parse_pool(workers: int, parser: str) -> ProcessPoolExecutor:
+    """Start a pool of parse worker processes for _parse_page_in_worker."""
+    logger.info(f"Parsing pages in {workers} worker processes")
+    # spawn, since forking a process that already runs worker threads can deadlock
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_parse_worker,
+        initargs=(parser,)
+    )
+
 class ShopifyScraper:
-    def __init__(self, max_workers: int = 8):
-        """Initialize the scraper with parallel processing settings."""
+    def __init__(self, max_workers: int = 8, engine: str = 'threads',
+                 fetch_concurrency: Optional[int] = None, llm_concurrency: Optional[int] = None,
+                 sitemap_concurrency: int = 4, parse_workers: Optional[int] = None,
+                 parse_processes: bool = False,
+                 rate_limit: float = 0.0, source: str = 'auto',
+                 llm_cache: Optional[LLMCache] = None, parser: str = 'auto',
+                 llm_token_budget: int = LLM_TOKEN_BUDGET, llm_batch_size: int = 1,
+                 crawl_state: Optional[CrawlState] = None, checkpoint: Optional[CheckpointLog] = None,
+                 http_cache: Optional[HTTPCache] = None, retry_policy: Optional[RetryPolicy] = None,
+                 adaptive_concurrency: bool = False, min_fetch_concurrency: int = 1,
+                 max_fetch_concurrency: int = 64, openai_api_key: Optional[str] = None,
+                 openai_client: Optional[openai.OpenAI] = None, llm_limiter: Optional[threading.Semaphore] = None,
+                 parse_pool: Optional[ProcessPoolExecutor] = None):
+        """Initialize the scraper with parallel processing settings.
+
+        Page fetches, HTML parsing and LLM calls run in separate pools sized by
+        fetch_concurrency, parse_workers and llm_concurrency; max_workers is the
+        default for the first and last, the CPU count for parsing. Up to
+        sitemap_concurrency sub-sitemaps are fetched at once. parse_processes runs
+        the parsing pool as worker processes so it is not serialized by the GIL.
+        rate_limit caps requests/second per host across all workers; with 0 (the
+        default) only 429 responses slow a host down.
+        source picks where product data comes from: 'json' uses the Shopify
+        /products.json and /products/<handle>.js endpoints, 'html' scrapes pages
+        with the LLM, and 'auto' tries JSON first and falls back to HTML.
+        llm_cache, if given, is consulted before every OpenAI call.
+        parser selects the HTML parser backend used by the fallback extractors.
+        llm_token_budget caps how much of a cleaned page is sent to the LLM.
+        llm_batch_size > 1 groups that many pages into each LLM request.
+        crawl_state, if given, enables incremental crawls: pages whose sitemap
+        lastmod or content hash is unchanged reuse their stored record.
+        checkpoint, if given, logs each finished product as it completes; URLs
+        already in the log are not crawled again.
+        http_cache, if given, revalidates sitemaps and product pages with
+        conditional requests; a 304 reuses the cached body and stored record.
+        retry_policy controls retries of 429/5xx responses and connection errors
+        for store and OpenAI requests.
+        adaptive_concurrency lets an AIMD controller set the number of in-flight
+        store requests between min_fetch_concurrency and max_fetch_concurrency,
+        starting from fetch_concurrency.
+        openai_client and llm_limiter let several scrapers share one OpenAI
+        connection pool and one cap on concurrent LLM calls; parse_pool lets them
+        share one set of parse worker processes, which the caller shuts down.
+        """
+        if engine not in ('threads', 'async'):
+            raise ValueError(f"Unknown engine: {engine}")
+        if source not in ('auto', 'json', 'html'):
+            raise ValueError(f"Unknown source: {source}")
+        if engine == 'async' and aiohttp is None:
+            raise ImportError("The async engine requires aiohttp (pip install aiohttp)")
+        
         self.max_workers = max_workers
+        self.engine = engine
+        self.fetch_concurrency = fetch_concurrency or max_workers
+        self.concurrency = None
+        if adaptive_concurrency:
+            self.concurrency = AIMDController(self.fetch_concurrency, min_fetch_concurrency, max_fetch_concurrency)
+            # Enough workers for the controller's ceiling; it decides how many are active
+            self.fetch_concurrency = self.concurrency.max_limit
+        self.llm_concurrency = llm_concurrency or max_workers
+        self.sitemap_concurrency = sitemap_concurrency
+        self.parse_workers = parse_workers or os.cpu_count() or max_workers
+        self.parse_processes = parse_processes
+        self.parse_pool = parse_pool
+        self.owns_parse_pool = parse_pool is None
+        self.llm_batch_size = llm_batch_size
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.source = source
+        # Flipped off the first time a store turns out to block /products/<handle>.js
+        self.product_js_enabled = source != 'html'
+        self.product_js_misses = 0
         self.session = requests.Session()
+        # Sitemap and product workers share one keep-alive pool per host
+        self.http_adapter = PooledHTTPAdapter(self.fetch_concurrency + self.sitemap_concurrency)
+        self.session.mount('https://', self.http_adapter)
+        self.session.mount('http://', self.http_adapter)
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': USER_AGENT
         })
         
         # Initialize OpenAI client
-        self.openai_client = openai.OpenAI(
-            api_key=os.getenv('OPENAI_API_KEY') or input("Please enter your OpenAI API key: ")
-        )
+        self.openai_api_key = (openai_api_key or os.getenv('OPENAI_API_KEY')
+                               or input("Please enter your OpenAI API key: "))
+        self.openai_client = openai_client or openai.OpenAI(api_key=self.openai_api_key,
+                                                            max_retries=self.retry_policy.max_retries)
+        self.llm_limiter = llm_limiter
+        self.async_openai_client = None
+        self.llm_cache = llm_cache
+        self.parser = parser
+        self.parser_backend = get_parser_backend(parser)
+        self.llm_token_budget = llm_token_budget
+        self.crawl_state = crawl_state
+        self.checkpoint = checkpoint
+        self.http_cache = http_cache
+        self.lastmods = {}  # product URL -> sitemap <lastmod>
+        self.llm_batcher = None
         
         # Store all products
         self.products = []
         self.lock = threading.Lock()
+        self.stats = Counter()
+        
+    def _retry_delay(self, url: str, attempt: int, reason: Any, retry_after: Optional[str] = None) -> Optional[float]:
+        """Return how long to wait before retrying a failed request, or None to give up.
+        
+        A 429 also pauses and slows down every worker's requests to that host.
+        """
+        delay = self.retry_policy.next_delay(attempt, RetryPolicy.parse_retry_after(retry_after))
+        if delay is None:
+            self._count('retries_exhausted')
+            return None
+        self._count('retries')
+        if reason == 429:
+            self.rate_limiter.back_off(url, delay)
+        logger.warning(f"Retrying {url} in {delay:.1f}s after {reason} (retry {attempt + 1})")
+        return delay
+    
+    @staticmethod
+    def _request_kind(url: str) -> str:
+        """Classify a store request for the concurrency controller's latency baselines."""
+        path = urlparse(url).path
+        if path.endswith('.xml'):
+            return 'sitemap'
+        if path.endswith(('.js', '.json')):
+            return 'json'
+        return 'page'
+    
+    def _get(self, url: str, stream: bool = False, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """GET a URL through the shared session, respecting the per-host rate limit.
+        
+        429/5xx responses and connection errors are retried with backoff; the
+        last response is returned once retries run out, for raise_for_status.
+        """
+        attempt = 0
+        while True:
+            # Take the slot first so a host paused while this worker waited for it is respected
+            if self.concurrency:
+                self.concurrency.acquire()
+            response = None
+            started = time.monotonic()
+            try:
+                self.rate_limiter.acquire(url)
+                started = time.monotonic()
+                response = self.session.get(url, timeout=30, stream=stream, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                if self.concurrency:
+                    # elapsed stops at the response headers, like aiohttp's get(), whether or not the body streams
+                    if response is not None:
+                        self.concurrency.release(response.elapsed.total_seconds(), response.status_code,
+                                                 self._request_kind(url))
+                    else:
+                        self.concurrency.release(time.monotonic() - started, None, self._request_kind(url))
+            if response is None:
+                delay = self._retry_delay(url, attempt, error)
+                if delay is None:
+                    raise error
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.rate_limiter.recover(url)
+                    return response
+                delay = self._retry_delay(url, attempt, response.status_code, response.headers.get('Retry-After'))
+                if delay is None:
+                    return response
+                # Read the (small) error body so the connection goes back to the pool
+                response.content
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+    
+    async def _get_async(self, session: 'aiohttp.ClientSession', url: str,
+                         headers: Optional[Dict[str, str]] = None,
+                         timeout: Optional['aiohttp.ClientTimeout'] = None) -> 'aiohttp.ClientResponse':
+        """Async version of _get; use the response as an async context manager.
+        
+        timeout overrides the session's timeout for this request.
+        """
+        attempt = 0
+        while True:
+            if self.concurrency:
+                await self.concurrency.acquire_async()
+            response = None
+            started = time.monotonic()
+            try:
+                await self.rate_limiter.acquire_async(url)
+                started = time.monotonic()
+                response = await session.get(url, headers=headers, timeout=timeout or session.timeout)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                if self.concurrency:
+                    self.concurrency.release(time.monotonic() - started,
+                                             response.status if response is not None else None,
+                                             self._request_kind(url))
+            if response is None:
+                delay = self._retry_delay(url, attempt, error)
+                if delay is None:
+                    raise error
+            else:
+                if response.status not in RETRY_STATUSES:
+                    self.rate_limiter.recover(url)
+                    return response
+                delay = self._retry_delay(url, attempt, response.status, response.headers.get('Retry-After'))
+                if delay is None:
+                    return response
+                response.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    def _cached_response(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return the HTTP cache entry for url, or None."""
+        return self.http_cache.get(url) if self.http_cache else None
+    
+    def _body_compressor(self, headers: Any) -> Optional[Tuple[Any, Optional[str], Optional[str]]]:
+        """Return (compressor, etag, last_modified) when a response can be cached, else None."""
+        etag, last_modified = HTTPCache.validators(headers)
+        if not self.http_cache or not (etag or last_modified):
+            return None
+        self._count('http_downloaded')
+        return zlib.compressobj(), etag, last_modified
+    
+    def _store_response(self, url: str, headers: Any, content: bytes):
+        """Cache a downloaded page together with its validators."""
+        cacheable = self._body_compressor(headers)
+        if cacheable:
+            compressor, etag, last_modified = cacheable
+            self.http_cache.put(url, etag, last_modified, compressor.compress(content) + compressor.flush())
+    
+    def _not_modified_page(self, url: str, cached: Dict[str, Any]) -> Dict[str, Any]:
+        """Fetch-stage result for a 304: the stored record when there is one, else the cached page."""
+        self._count('http_not_modified')
+        content = b''.join(HTTPCache.iter_body(cached['body']))
+        if cached['record']:
+            self._remember_product(url, self._content_hash(content), cached['record'])
+            return {'url': url, 'product': cached['record']}
+        return {'url': url, 'content': content, 'html': content.decode('utf-8', errors='replace')}
+    
+    def _sitemap_index_url(self, base_url: str) -> str:
+        """Return the sitemap.xml URL for a store."""
+        # Ensure base_url ends with /
+        if not base_url.endswith('/'):
+            base_url += '/'
+        return urljoin(base_url, 'sitemap.xml')
+    
+    def _is_product_url(self, url: str) -> bool:
+        """Filter for product URLs (common patterns)."""
+        return any(pattern in url.lower() for pattern in ['/products/', '/product/'])
+    
+    def _filter_product_sitemaps(self, sitemap_urls: List[str]) -> List[str]:
+        """Drop sub-sitemaps that cannot hold products (pages, blogs, collections) based on the filename."""
+        product_sitemaps = []
+        for sitemap_url in sitemap_urls:
+            filename = urlparse(sitemap_url).path.rsplit('/', 1)[-1].lower()
+            if 'product' in filename or not any(kind in filename for kind in NON_PRODUCT_SITEMAPS):
+                product_sitemaps.append(sitemap_url)
+        skipped = len(sitemap_urls) - len(product_sitemaps)
+        if skipped:
+            logger.info(f"Skipping {skipped} non-product sitemaps")
+        return product_sitemaps
+    
+    def _remember_lastmod(self, url: str, lastmod: Optional[str]):
+        """Record a sitemap lastmod for incremental crawls."""
+        if lastmod:
+            with self.lock:
+                self.lastmods[url] = lastmod
+    
+    def iter_sitemap_entries(self, sitemap_url: str) -> Iterator[Tuple[str, str, Optional[str]]]:
+        """Stream (tag, loc, lastmod) entries from a sitemap while the response downloads.
         
+        With an HTTP cache the sitemap is revalidated, and a 304 replays the cached copy.
+        """
+        cached = self._cached_response(sitemap_url)
+        response = self._get(sitemap_url, stream=True, headers=HTTPCache.request_headers(cached))
+        with response:
+            parser = SitemapStreamParser()
+            if cached and response.status_code == 304:
+                self._count('http_not_modified')
+                for chunk in HTTPCache.iter_body(cached['body'], SITEMAP_CHUNK_SIZE):
+                    yield from parser.feed(chunk)
+                yield from parser.close()
+                return
+            
+            response.raise_for_status()
+            cacheable = self._body_compressor(response.headers)
+            compressed = []
+            for chunk in response.iter_content(chunk_size=SITEMAP_CHUNK_SIZE):
+                if cacheable:
+                    compressed.append(cacheable[0].compress(chunk))
+                yield from parser.feed(chunk)
+            yield from parser.close()
+        if cacheable:
+            compressor, etag, last_modified = cacheable
+            self.http_cache.put(sitemap_url, etag, last_modified, b''.join(compressed) + compressor.flush())
+    
     def get_sitemap_urls(self, base_url: str) -> List[str]:
         """Extract all sitemap URLs from the main sitemap.xml."""
+        sitemap_urls = []
         try:
-            # Ensure base_url ends with /
-            if not base_url.endswith('/'):
-                base_url += '/'
-            
-            sitemap_url = urljoin(base_url, 'sitemap.xml')
+            sitemap_url = self._sitemap_index_url(base_url)
             logger.info(f"Fetching sitemap from: {sitemap_url}")
             
-            response = self.session.get(sitemap_url, timeout=30)
-            response.raise_for_status()
-            
-            # Parse XML using built-in parser
-            try:
-                root = ET.fromstring(response.content)
-            except ET.ParseError as e:
-                logger.error(f"Failed to parse sitemap XML: {e}")
-                return []
-            
-            # Extract sitemap URLs - handle different namespace formats
-            sitemap_urls = []
-            
-            # Try different namespace patterns
-            namespaces = [
-                '{http://www.sitemaps.org/schemas/sitemap/0.9}',
-                '',
-                '{http://www.google.com/schemas/sitemap/0.84}'
-            ]
-            
-            for namespace in namespaces:
-                sitemap_elements = root.findall(f'.//{namespace}sitemap')
-                if sitemap_elements:
-                    for sitemap in sitemap_elements:
-                        loc = sitemap.find(f'{namespace}loc')
-                        if loc is not None and loc.text:
-                            sitemap_urls.append(loc.text)
-                    break
-            
-            logger.info(f"Found {len(sitemap_urls)} sitemap URLs")
-            return sitemap_urls
+            for tag, loc, _ in self.iter_sitemap_entries(sitemap_url):
+                if tag == 'sitemap':
+                    sitemap_urls.append(loc)
             
+        except ET.ParseError as e:
+            logger.error(f"Failed to parse sitemap XML: {e}")
         except Exception as e:
-            logger.error(f"Error fetching sitemap: {e}")
-            return []
+            logger.error(f"Error fetching sitemap: {e!r}")
+        
+        logger.info(f"Found {len(sitemap_urls)} sitemap URLs")
+        return sitemap_urls
     
-    def get_product_urls_from_sitemap(self, sitemap_url: str) -> List[str]:
-        """Extract product URLs from a sitemap."""
+    def iter_product_urls_from_sitemap(self, sitemap_url: str) -> Iterator[str]:
+        """Yield product URLs from a sitemap as soon as they are parsed."""
+        count = 0
         try:
             logger.info(f"Fetching product URLs from: {sitemap_url}")
-            response = self.session.get(sitemap_url, timeout=30)
-            response.raise_for_status()
+            for tag, loc, lastmod in self.iter_sitemap_entries(sitemap_url):
+                if tag == 'url' and self._is_product_url(loc):
+                    self._remember_lastmod(loc, lastmod)
+                    count += 1
+                    yield loc
             
+        except ET.ParseError as e:
+            logger.error(f"Failed to parse sitemap XML {sitemap_url}: {e}")
+        except Exception as e:
+            logger.error(f"Error fetching product URLs from {sitemap_url}: {e!r}")
+        
+        logger.info(f"Found {count} product URLs in {sitemap_url}")
+    
+    def get_product_urls_from_sitemap(self, sitemap_url: str) -> List[str]:
+        """Extract product URLs from a sitemap."""
+        return list(self.iter_product_urls_from_sitemap(sitemap_url))
+    
+    # --- SHOPIFY JSON FAST PATH ---
+    
+    @staticmethod
+    def _price_to_cents(price: Any, in_cents: bool) -> int:
+        """Convert a Shopify price ("19.99" or 1999) to integer cents."""
+        if price is None or price == '':
+            return 0
+        if in_cents:
+            return int(price)
+        return int(round(float(price) * 100))
+    
+    @staticmethod
+    def _map_shopify_product_json(data: Dict[str, Any], url: str, prices_in_cents: bool) -> Dict[str, Any]:
+        """Map a products.json entry or a /products/<handle>.js document to our product record.
+        
+        products.json reports prices as decimal strings, the .js endpoint in cents.
+        """
+        option_names = []
+        for option in data.get('options') or []:
+            name = option.get('name') if isinstance(option, dict) else option
+            option_names.append(str(name).lower() if name else '')
+        
+        variants = []
+        for variant in data.get('variants') or []:
+            options = {}
+            for position, name in enumerate(option_names, start=1):
+                value = variant.get(f'option{position}')
+                if name and value is not None:
+                    options[name] = value
+            image = (variant.get('featured_image') or {}).get('src') or ''
+            if image.startswith('//'):
+                image = 'https:' + image
+            variants.append({
+                'id': variant.get('id'),
+                'name': variant.get('title') or '',
+                'sku': variant.get('sku') or '',
+                'price': ShopifyScraper._price_to_cents(variant.get('price'), prices_in_cents),
+                'availability': 'in stock' if variant.get('available', True) else 'out of stock',
+                'image': image,
+                'options': options
+            })
+        
+        images = []
+        for image in data.get('images') or []:
+            src = image.get('src') if isinstance(image, dict) else image
+            if src:
+                images.append('https:' + src if src.startswith('//') else src)
+        
+        tags = data.get('tags') or []
+        if isinstance(tags, str):
+            tags = [tag.strip() for tag in tags.split(',') if tag.strip()]
+        
+        description_html = data.get('body_html') or data.get('description') or ''
+        description = BeautifulSoup(description_html, 'html.parser').get_text(' ', strip=True)
+        
+        if 'price' in data:
+            price = ShopifyScraper._price_to_cents(data.get('price'), prices_in_cents)
+        else:
+            price = variants[0]['price'] if variants else 0
+        
+        if 'available' in data:
+            available = data['available']
+        else:
+            available = any(variant.get('available', True) for variant in data.get('variants') or [])
+        
+        return {
+            'url': url,
+            'id': data.get('id'),
+            'gid': f"gid://shopify/Product/{data['id']}" if data.get('id') else None,
+            'vendor': data.get('vendor'),
+            'type': data.get('product_type') or data.get('type'),
+            'price': price,
+            'name': data.get('title') or '',
+            'description': description,
+            'availability': 'in stock' if available else 'out of stock',
+            'tags': tags,
+            'images': images,
+            'weight': None,
+            'dimensions': None,
+            'tax_info': None,
+            'reviews': [],
+            'variants': variants
+        }
+    
+    def get_products_from_json(self, base_url: str) -> Optional[List[Dict[str, Any]]]:
+        """Page through /products.json (250 per request).
+        
+        Returns None when the store has the endpoint disabled.
+        """
+        if not base_url.endswith('/'):
+            base_url += '/'
+        
+        products = []
+        page = 1
+        while True:
+            page_url = urljoin(base_url, f'products.json?limit=250&page={page}')
             try:
-                root = ET.fromstring(response.content)
-            except ET.ParseError as e:
-                logger.error(f"Failed to parse sitemap XML: {e}")
-                return []
-            
-            # Extract URLs - handle different namespace formats
-            product_urls = []
-            namespaces = [
-                '{http://www.sitemaps.org/schemas/sitemap/0.9}',
-                '',
-                '{http://www.google.com/schemas/sitemap/0.84}'
-            ]
-            
-            for namespace in namespaces:
-                url_elements = root.findall(f'.//{namespace}url')
-                if url_elements:
-                    for url_elem in url_elements:
-                        loc = url_elem.find(f'{namespace}loc')
-                        if loc is not None and loc.text:
-                            url_text = loc.text
-                            # Filter for product URLs (common patterns)
-                            if any(pattern in url_text.lower() for pattern in ['/products/', '/product/']):
-                                product_urls.append(url_text)
-                    break
+                logger.info(f"Fetching products from: {page_url}")
+                response = self._get(page_url)
+                response.raise_for_status()
+                items = response.json().get('products')
+                if not isinstance(items, list):
+                    raise ValueError("response has no products list")
+            except Exception as e:
+                if page == 1:
+                    logger.info(f"products.json not available for {base_url}: {e}")
+                    return None
+                logger.warning(f"Stopping products.json pagination at page {page}: {e}")
+                break
             
-            logger.info(f"Found {len(product_urls)} product URLs in {sitemap_url}")
-            return product_urls
-            
-        except Exception as e:
-            logger.error(f"Error fetching product URLs from {sitemap_url}: {e}")
-            return []
+            if not items:
+                break
+            for item in items:
+                url = urljoin(base_url, f"products/{item.get('handle', '')}")
+                products.append(self._map_shopify_product_json(item, url, prices_in_cents=False))
+            page += 1
+        
+        logger.info(f"Fetched {len(products)} products from products.json in {page} requests")
+        return products
     
-    def extract_product_data_with_gpt(self, html_content: str, url: str) -> Optional[Dict[str, Any]]:
-        """Use ChatGPT to extract structured product data from HTML, including variants."""
+    def _product_js_url(self, url: str) -> str:
+        """Return the /products/<handle>.js URL for a product page URL."""
+        return url.split('?')[0].split('#')[0].rstrip('/') + '.js'
+    
+    def _product_js_unavailable(self, url: str, status: int) -> bool:
+        """Check a /products/<handle>.js status; True means fall back to the HTML page.
+        
+        401/403 disable the endpoint for the rest of the crawl. A 404 only means this
+        product is gone (e.g. a stale sitemap entry) unless PRODUCT_JS_MAX_MISSES
+        products in a row are missing.
+        """
+        with self.lock:
+            if status not in (401, 403, 404):
+                self.product_js_misses = 0
+                return False
+            if status == 404:
+                self.product_js_misses += 1
+                if self.product_js_misses < PRODUCT_JS_MAX_MISSES:
+                    logger.info(f"Product JSON not found for {url}, falling back to HTML")
+                    return True
+            if self.product_js_enabled:
+                logger.info(f"Product JSON endpoint disabled, falling back to HTML: {status}")
+                self.product_js_enabled = False
+            return True
+    
+    def scrape_product_json(self, url: str) -> Optional[Dict[str, Any]]:
+        """Fetch a single product from /products/<handle>.js."""
         try:
-            # Prepare the prompt for GPT with enhanced data extraction
-            prompt = f"""
-            Extract comprehensive product information from this Shopify product page HTML. Return ONLY a JSON object with these exact fields:
-            - id: Numeric product ID (internal Shopify ID)
-            - gid: Global ID (gid://shopify/Product/...)
-            - vendor: Brand or manufacturer (should be "Down to Earth Project LLC" for this store)
-            - type: Product category/type
-            - price: Price in cents (e.g., 15000 = $150.00)
-            - name: Full product name with variant description
-            - description: Full product description text
-            - availability: Availability status (in stock, out of stock, pre-order, etc.)
-            - tags: Array of product tags/categories
-            - images: Array of image URLs (main product images)
-            - weight: Product weight if available
-            - dimensions: Product dimensions if available
-            - tax_info: Tax/VAT information if available
-            - reviews: Array of review objects with rating and text if available
-            - variants: Array of variant objects, each with:
-                - id: Variant ID (look for data-variant-id, variant_id, or similar attributes)
-                - name: Variant name (e.g., "L / Black", "Medium / Blue", etc.)
-                - sku: Stock Keeping Unit
-                - price: Price in cents
-                - availability: Availability status
-                - image: Image URL for the variant if available
-                - options: Object with size, color, etc. (e.g., {{"size": "L", "color": "Black"}})
-            
-            IMPORTANT: Look carefully for variant information in:
-            - <select> elements with size/color options
-            - data attributes like data-variant-id, data-option-value
-            - JSON-LD structured data
-            - JavaScript variables containing variant data
-            - Form elements with variant selections
-            
-            If any field is not found, use null. For arrays, use empty array if none found.
-            Return ONLY the JSON object, no other text.
-            
-            HTML Content:
-            {html_content[:12000]}  # Increased content limit for more data
-            """
-            
+            response = self._get(self._product_js_url(url))
+            if self._product_js_unavailable(url, response.status_code):
+                return None
+            response.raise_for_status()
+            return self._map_shopify_product_json(response.json(), url, prices_in_cents=True)
+        except Exception as e:
+            logger.warning(f"Could not load product JSON for {url}: {e}")
+            return None
+    
+    # --- STRUCTURED DATA (JSON-LD / SHOPIFYANALYTICS) ---
+    
+    def _count(self, key: str, amount: int = 1):
+        """Increment a crawl statistic."""
+        with self.lock:
+            self.stats[key] += amount
+    
+    @staticmethod
+    def _schema_availability_to_text(availability: Optional[str]) -> Optional[str]:
+        """Map a schema.org availability URL to the text form used in product records."""
+        if not availability:
+            return None
+        value = availability.rsplit('/', 1)[-1].lower()
+        if value in ('instock', 'limitedavailability', 'onlineonly', 'instoreonly'):
+            return 'in stock'
+        if value in ('outofstock', 'soldout', 'discontinued'):
+            return 'out of stock'
+        if value in ('preorder', 'presale', 'backorder'):
+            return 'pre-order'
+        return None
+    
+    @staticmethod
+    def extract_structured_data(page: ProductPage) -> Dict[str, Any]:
+        """Build a product record from embedded product JSON, JSON-LD and ShopifyAnalytics meta.
+        
+        Fields that the page does not carry are left empty.
+        """
+        if page.product_json:
+            return ShopifyScraper._map_shopify_product_json(page.product_json, page.url, prices_in_cents=True)
+        
+        ld = page.json_ld_product or {}
+        meta = (page.shopify_meta or {}).get('product') or {}
+        
+        offers = []
+        for item in [ld] + [v for v in ld.get('hasVariant') or [] if isinstance(v, dict)]:
+            item_offers = item.get('offers') or []
+            for offer in item_offers if isinstance(item_offers, list) else [item_offers]:
+                if isinstance(offer, dict):
+                    offers.append(dict(offer, sku=offer.get('sku') or item.get('sku')))
+        offers_by_variant = {}
+        offers_by_sku = {}
+        for offer in offers:
+            variant_match = re.search(r'variant=(\d+)', offer.get('url') or '')
+            if variant_match:
+                offers_by_variant[variant_match.group(1)] = offer
+            if offer.get('sku'):
+                offers_by_sku[offer['sku']] = offer
+        
+        variants = []
+        for variant in meta.get('variants') or []:
+            offer = offers_by_variant.get(str(variant.get('id'))) or offers_by_sku.get(variant.get('sku')) or {}
+            title = variant.get('public_title') or ''
+            values = title.split(' / ') if title else []
+            options = dict(zip(page.option_names, values)) if len(values) == len(page.option_names) else {}
+            variants.append({
+                'id': variant.get('id'),
+                'name': title or variant.get('name') or '',
+                'sku': variant.get('sku') or '',
+                'price': ShopifyScraper._price_to_cents(variant.get('price'), in_cents=True),
+                'availability': ShopifyScraper._schema_availability_to_text(offer.get('availability')),
+                'image': '',
+                'options': options
+            })
+        if not variants:
+            for offer in offers:
+                variant_match = re.search(r'variant=(\d+)', offer.get('url') or '')
+                variants.append({
+                    'id': variant_match.group(1) if variant_match else None,
+                    'name': '',
+                    'sku': offer.get('sku') or '',
+                    'price': ShopifyScraper._price_to_cents(offer.get('price'), in_cents=False),
+                    'availability': ShopifyScraper._schema_availability_to_text(offer.get('availability')),
+                    'image': '',
+                    'options': {}
+                })
+        
+        images = []
+        ld_images = ld.get('image') or []
+        for image in ld_images if isinstance(ld_images, list) else [ld_images]:
+            src = image.get('url') if isinstance(image, dict) else image
+            if src:
+                images.append('https:' + src if src.startswith('//') else src)
+        
+        brand = ld.get('brand')
+        availabilities = [variant['availability'] for variant in variants if variant['availability']]
+        if 'in stock' in availabilities:
+            availability = 'in stock'
+        else:
+            availability = availabilities[0] if availabilities else None
+        
+        product_id = meta.get('id')
+        return {
+            'url': page.url,
+            'id': product_id,
+            'gid': meta.get('gid') or (f"gid://shopify/Product/{product_id}" if product_id else None),
+            'vendor': meta.get('vendor') or (brand.get('name') if isinstance(brand, dict) else brand),
+            'type': meta.get('type') or None,
+            'price': variants[0]['price'] if variants else 0,
+            'name': ld.get('name') or '',
+            'description': ld.get('description') or '',
+            'availability': availability,
+            'tags': [],
+            'images': images,
+            'weight': None,
+            'dimensions': None,
+            'tax_info': None,
+            'reviews': [],
+            'variants': variants
+        }
+    
+    @staticmethod
+    def _missing_product_fields(product_data: Dict[str, Any]) -> List[str]:
+        """Return the required fields that are still empty."""
+        return [field for field in REQUIRED_PRODUCT_FIELDS if not product_data.get(field)]
+    
+    def _merge_structured_data(self, product_data: Optional[Dict[str, Any]],
+                               structured: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Overlay deterministic structured values onto an LLM or fallback result.
+        
+        Structured scalars win; other lists only fill empty ones, and variants
+        are merged field by field so the LLM's names and options are kept.
+        """
+        if product_data is None:
+            return None
+        for key, value in structured.items():
+            if value in (None, '', [], {}, 0):
+                continue
+            if key == 'variants':
+                product_data[key] = self._merge_variants(product_data.get(key), value)
+            elif isinstance(value, list):
+                if not product_data.get(key):
+                    product_data[key] = value
+            else:
+                product_data[key] = value
+        return product_data
+    
+    @staticmethod
+    def _merge_variants(llm_variants: Any, structured_variants: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge structured variants into the LLM's, matched by id or sku (or by position when the LLM gave neither)."""
+        merged = [dict(variant) for variant in llm_variants or [] if isinstance(variant, dict)]
+        by_id = {str(variant['id']): variant for variant in merged if variant.get('id')}
+        by_sku = {variant['sku']: variant for variant in merged if variant.get('sku')}
+        by_position = not by_id and not by_sku and len(merged) == len(structured_variants)
+        for i, variant in enumerate(structured_variants):
+            if by_position:
+                target = merged[i]
+            else:
+                target = by_id.get(str(variant.get('id'))) or by_sku.get(variant.get('sku'))
+            if target is None:
+                merged.append(dict(variant))
+                continue
+            for key, value in variant.items():
+                if value not in (None, '', [], {}, 0):
+                    target[key] = value
+        return merged
+    
+    def _resolve_structured(self, page: ProductPage) -> Tuple[Dict[str, Any], bool]:
+        """Run structured extraction and report whether the LLM is still needed."""
+        structured = self.extract_structured_data(page)
+        missing = self._missing_product_fields(structured)
+        if not missing:
+            self._count('structured_pages')
+            return structured, False
+        
+        logger.debug(f"Structured data for {page.url} is missing {missing}, using the LLM")
+        self._count('llm_pages')
+        return structured, True
+    
+    def _strip_attributes(self, match: 're.Match') -> str:
+        """Rewrite an opening tag keeping only extraction-relevant attributes."""
+        tag, attributes, self_closing = match.groups()
+        kept = []
+        for attribute in LLM_ATTRIBUTE_PATTERN.finditer(attributes):
+            name = attribute.group(1).lower()
+            if name in LLM_KEEP_ATTRIBUTES:
+                kept.append(attribute.group(0))
+        return f"<{tag}{' ' if kept else ''}{' '.join(kept)}{self_closing}>"
+    
+    def _trim_html_for_llm(self, page: ProductPage) -> str:
+        """Return the part of the page that is sent to the LLM.
+        
+        Keeps JSON-LD, product JSON and the ShopifyAnalytics meta, drops scripts, styles, SVG, navigation
+        and irrelevant attributes, starts at the product section and packs the
+        result into the token budget.
+        """
+        html_content = page.html
+        kept_scripts = [re.sub(r'\s+', ' ', script) for script in LLM_KEEP_SCRIPT_PATTERN.findall(html_content)]
+        meta = page.shopify_meta
+        if meta:
+            kept_scripts.append(f"<script>var meta = {json.dumps(meta, separators=(',', ':'))};</script>")
+        
+        title_match = re.search(r'<title[^>]*>(.*?)</title>', html_content, re.DOTALL | re.IGNORECASE)
+        body = LLM_DROP_BLOCK_PATTERN.sub('', html_content)
+        body = LLM_DROP_TAG_PATTERN.sub('', body)
+        
+        section_match = LLM_PRODUCT_SECTION_PATTERN.search(body)
+        if section_match:
+            # Back up to the tag holding the match; a <main match starts with that tag itself
+            body = body[max(0, body.rfind('<', 0, section_match.start() + 1)):]
+        
+        body = LLM_TAG_PATTERN.sub(self._strip_attributes, body)
+        body = re.sub(r'\s+', ' ', body)
+        body = re.sub(r'>\s+<', '><', body)
+        
+        parts = []
+        if title_match:
+            parts.append(f"<title>{title_match.group(1).strip()}</title>")
+        parts.extend(kept_scripts)
+        parts.append(body.strip())
+        trimmed = '\n'.join(parts)[:self.llm_token_budget * CHARS_PER_TOKEN]
+        
+        raw_tokens, sent_tokens = estimate_tokens(html_content), estimate_tokens(trimmed)
+        self._count('llm_tokens_raw', raw_tokens)
+        self._count('llm_tokens_sent', sent_tokens)
+        logger.debug(f"LLM prompt for {page.url}: {sent_tokens} tokens, {raw_tokens - sent_tokens} saved by trimming")
+        return trimmed
+    
+    def _llm_cache_key(self, trimmed_html: str) -> str:
+        """Cache key for an extraction: page content, prompt version and model."""
+        return LLMCache.make_key(trimmed_html, PROMPT_VERSION, LLM_MODEL)
+    
+    def _prepare_llm_request(self, page: ProductPage) -> Tuple[str, str, Optional[str]]:
+        """Trim the page and look it up in the LLM cache: (trimmed_html, cache_key, cached_content)."""
+        trimmed_html = self._trim_html_for_llm(page)
+        cache_key = self._llm_cache_key(trimmed_html)
+        return trimmed_html, cache_key, self.llm_cache.get(cache_key) if self.llm_cache else None
+    
+    def _build_gpt_messages(self, trimmed_html: str) -> List[Dict[str, str]]:
+        """Build the chat messages used to extract product data from trimmed HTML."""
+        # Prepare the prompt for GPT with enhanced data extraction
+        prompt = f"""
+        Extract comprehensive product information from this Shopify product page HTML. Return ONLY a JSON object with these exact fields:
+{PRODUCT_FIELDS_PROMPT}        If any field is not found, use null. For arrays, use empty array if none found.
+        Return ONLY the JSON object, no other text.
+        
+        HTML Content:
+        {trimmed_html}
+        """
+        
+        return [
+            {"role": "system", "content": LLM_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _build_batch_gpt_messages(self, items: List[tuple]) -> List[Dict[str, str]]:
+        """Build one request that extracts several pages, given (trimmed_html, url) pairs."""
+        pages = "\n\n".join(
+            f"[ITEM {index}] URL: {url}\n{trimmed_html}" for index, (trimmed_html, url) in enumerate(items)
+        )
+        prompt = f"""
+        Extract comprehensive product information from each of the {len(items)} Shopify product pages below.
+        Return ONLY a JSON array with exactly one object per page. Each object must have an "item_index" field with
+        the number from the page's [ITEM n] marker, a "url" field with the page URL, and these exact fields:
+{PRODUCT_FIELDS_PROMPT}        If any field is not found, use null. For arrays, use empty array if none found.
+        Return ONLY the JSON array, no other text.
+        
+        Pages:
+        {pages}
+        """
+        
+        return [
+            {"role": "system", "content": LLM_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _complete_single(self, trimmed_html: str) -> str:
+        """Run one single-product extraction call and return the response text."""
+        with self.llm_limiter or contextlib.nullcontext():
             response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a data extraction expert. Extract comprehensive product information and return only valid JSON. Pay special attention to finding ALL product variants, their sizes, colors, prices, and IDs. Look for variant data in select elements, data attributes, JSON-LD, and JavaScript variables."},
-                    {"role": "user", "content": prompt}
-                ],
+                model=LLM_MODEL,
+                messages=self._build_gpt_messages(trimmed_html),
                 max_tokens=2000,  # Increased token limit for more data
                 temperature=0
             )
+        return response.choices[0].message.content
+    
+    def _complete_batch(self, items: List[tuple]) -> List[Optional[str]]:
+        """Run one multi-product extraction call.
+        
+        Returns a JSON object string per (trimmed_html, url) item, or None for
+        items whose result was missing or did not match its URL.
+        """
+        self._count('llm_batches')
+        with self.llm_limiter or contextlib.nullcontext():
+            response = self.openai_client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=self._build_batch_gpt_messages(items),
+                max_tokens=4000,
+                temperature=0
+            )
+        content = response.choices[0].message.content.strip()
+        
+        results = [None] * len(items)
+        json_match = re.search(r'\[.*\]', content, re.DOTALL)
+        if not json_match:
+            logger.warning("Could not extract JSON array from batched GPT response")
+            return results
+        entries = json.loads(json_match.group())
+        
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            index = entry.pop('item_index', None)
+            if not isinstance(index, int) or not 0 <= index < len(items):
+                continue
+            if entry.get('url') and entry['url'] != items[index][1]:
+                logger.warning(f"Batched GPT result {index} is for {entry['url']}, expected {items[index][1]}")
+                continue
+            results[index] = json.dumps(entry)
+        
+        retries = results.count(None)
+        if retries:
+            self._count('llm_batch_retries', retries)
+        return results
+    
+    def _parse_gpt_response(self, content: str, page: ProductPage) -> Optional[Dict[str, Any]]:
+        """Turn a chat completion into product data, or None when it holds no usable JSON object."""
+        # Try to find JSON in the response
+        json_match = re.search(r'\{.*\}', content.strip(), re.DOTALL)
+        if not json_match:
+            return None
+        try:
+            product_data = json.loads(json_match.group())
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(product_data, dict):
+            return None
+        product_data['url'] = page.url
+        
+        # Apply fallback fixes for common issues, including variants
+        return self._apply_fallback_fixes(product_data, page)
+    
+    def extract_product_data_with_gpt(self, html_content: str, url: str,
+                                      page: Optional[ProductPage] = None) -> Optional[Dict[str, Any]]:
+        """Use ChatGPT to extract structured product data from HTML, including variants."""
+        page = page or ProductPage(html_content, url, self.parser_backend)
+        try:
+            trimmed_html, cache_key, content = self._prepare_llm_request(page)
+            product_data = self._parse_gpt_response(content, page) if content is not None else None
             
-            # Extract JSON from response
-            content = response.choices[0].message.content.strip()
+            if product_data is None:
+                if self.llm_batcher:
+                    content = self.llm_batcher.submit(trimmed_html, url).result()
+                else:
+                    content = self._complete_single(trimmed_html)
+                product_data = self._parse_gpt_response(content, page)
+                if product_data is None:
+                    logger.warning(f"Could not extract JSON from GPT response for {url}")
+                    return self._fallback_extraction(page)
+                # Only cache responses that parse, so a bad completion is not replayed on later runs
+                if self.llm_cache:
+                    self.llm_cache.put(cache_key, content)
             
-            # Try to find JSON in the response
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                product_data = json.loads(json_match.group())
-                product_data['url'] = url
-                
-                # Apply fallback fixes for common issues, including variants
-                product_data = self._apply_fallback_fixes(product_data, html_content, url)
-                
-                return product_data
-            else:
-                logger.warning(f"Could not extract JSON from GPT response for {url}")
-                # Try fallback extraction
-                return self._fallback_extraction(html_content, url)
+            return product_data
                 
         except Exception as e:
             logger.error(f"Error extracting product data with GPT for {url}: {e}")
             # Try fallback extraction
-            return self._fallback_extraction(html_content, url)
+            return self._fallback_extraction(page)
+    
+    def _apply_fallback_fixes(self, product_data: Dict[str, Any], page: ProductPage) -> Dict[str, Any]:
+        """Apply fallback fixes for common extraction issues, including variants."""
+        # Fix vendor if null
+        if not product_data.get('vendor'):
+            product_data['vendor'] = "Down to Earth Project LLC"
+        
+        # Try to extract product ID from various sources
+        if not product_data.get('id') or product_data.get('id') == 'None':
+            if page.product_id:
+                product_data['id'] = page.product_id
+                product_data['gid'] = f"gid://shopify/Product/{page.product_id}"
+        
+        # Try to extract price if missing or wrong
+        if not product_data.get('price') or product_data.get('price') == 0:
+            if page.price:
+                product_data['price'] = page.price
+        
+        # Try to extract images if missing
+        if not product_data.get('images') or not isinstance(product_data.get('images'), list):
+            product_data['images'] = list(page.images)
+        
+        # Try to extract description if missing
+        if not product_data.get('description'):
+            if page.description:
+                product_data['description'] = page.description
+        
+        # Fallback for variants if missing or empty
+        if not product_data.get('variants') or not isinstance(product_data.get('variants'), list) or not product_data['variants']:
+            product_data['variants'] = self._extract_variants_from_html(page)
+        
+        return product_data
+    
+    def _extract_variants_from_html(self, page: ProductPage) -> list:
+        """Return an empty list for variants (temporarily disabled extraction)."""
+        return []
+    
+    def _fallback_extraction(self, page: ProductPage) -> Optional[Dict[str, Any]]:
+        """Fallback extraction method when GPT fails."""
+        url = page.url
+        try:
+            # Extract basic product info
+            product_data = {
+                'url': url,
+                'vendor': 'Down to Earth Project LLC',
+                'name': page.name,
+                'price': page.price,
+                'id': None,
+                'gid': None,
+                'description': page.description,
+                'images': list(page.images),
+                'availability': 'in stock',
+                'tags': [],
+                'type': None,
+                'sku': None,
+                'variant_id': None,
+                'public_title': None,
+                'weight': None,
+                'dimensions': None,
+                'tax_info': None,
+                'reviews': [],
+                'variants': []
+            }
+            
+            # Try to extract product ID from URL
+            url_match = re.search(r'/products/([^/?]+)', url)
+            if url_match:
+                product_data['id'] = url_match.group(1)
+                product_data['gid'] = f"gid://shopify/Product/{product_data['id']}"
+            
+            # Extract variants
+            product_data['variants'] = self._extract_variants_from_html(page)
+            
+            return product_data
+            
+        except Exception as e:
+            logger.error(f"Fallback extraction failed for {url}: {e}")
+            return None
+    
+    # --- INCREMENTAL CRAWL ---
+    
+    def _resume_completed(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return the checkpointed record for url if an earlier, interrupted run finished it."""
+        if not self.checkpoint:
+            return None
+        product_data = self.checkpoint.get(url)
+        if product_data:
+            self._count('resumed')
+        return product_data
+    
+    def _reuse_unchanged_lastmod(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return the stored record for url if its sitemap lastmod matches the one recorded last run."""
+        if not self.crawl_state:
+            return None
+        state = self.crawl_state.get(url)
+        lastmod = self.lastmods.get(url)
+        if state and lastmod and state['lastmod'] == lastmod:
+            self._count('unchanged_lastmod')
+            return state['record']
+        return None
+    
+    def _content_hash(self, content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+    
+    def _reuse_unchanged_content(self, url: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the stored record for url if the page body has not changed since it was extracted."""
+        if not self.crawl_state:
+            return None
+        state = self.crawl_state.get(url)
+        if state and state['content_hash'] == content_hash:
+            self._count('unchanged_content')
+            return state['record']
+        return None
+    
+    def _remember_product(self, url: str, content_hash: Optional[str], product_data: Optional[Dict[str, Any]]):
+        """Store a scraped product and its current lastmod in the crawl state."""
+        if self.crawl_state and product_data:
+            self.crawl_state.put(url, self.lastmods.get(url), content_hash, product_data)
+        if self.http_cache and product_data and content_hash:
+            self.http_cache.put_record(url, product_data)
+    
+    def _fetch_product_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """Fetch stage of scrape_product_page.
+        
+        Returns {'url', 'product'} when the product JSON endpoint answered,
+        {'url', 'content', 'html'} with the raw page otherwise, or None on failure.
+        """
+        if self.product_js_enabled:
+            product_data = self.scrape_product_json(url)
+            if product_data:
+                self._remember_product(url, None, product_data)
+                return {'url': url, 'product': product_data}
+            if self.source == 'json':
+                return None
+        
+        try:
+            logger.info(f"Scraping product page: {url}")
+            cached = self._cached_response(url)
+            response = self._get(url, headers=HTTPCache.request_headers(cached))
+            if cached and response.status_code == 304:
+                return self._not_modified_page(url, cached)
+            response.raise_for_status()
+            self._store_response(url, response.headers, response.content)
+            return {'url': url, 'content': response.content, 'html': response.text}
+            
+        except Exception as e:
+            logger.error(f"Error scraping product page {url}: {e!r}")
+            self._count('failed_pages')
+            return None
+    
+    def _log_extraction_result(self, url: str, product_data: Optional[Dict[str, Any]]):
+        if product_data:
+            logger.info(f"Successfully extracted data for product: {product_data.get('name', 'Unknown')}")
+        else:
+            logger.warning(f"Failed to extract product data from {url}")
+    
+    def _structure_fetched_page(self, fetched: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[ProductPage]]:
+        """Run structured extraction, in the parse process pool when one is running.
+        
+        Returns the structured record and, when the LLM is still needed, the page.
+        """
+        url = fetched['url']
+        if self.parse_pool is None:
+            page = ProductPage(fetched['html'], url, self.parser_backend)
+            structured, needs_llm = self._resolve_structured(page)
+            return structured, page if needs_llm else None
+        
+        structured, fields = self.parse_pool.submit(_parse_page_in_worker, fetched['content'], url).result()
+        if fields is None:
+            self._count('structured_pages')
+            return structured, None
+        self._count('llm_pages')
+        return structured, ProductPage.from_fields(fetched['html'], url, fields, self.parser_backend)
+    
+    def _start_parse_pool(self):
+        """Start the parse worker processes if parse_processes is set."""
+        if self.parse_processes and self.parse_pool is None:
+            self.parse_pool = start_parse_pool(self.parse_workers, self.parser)
+    
+    def _stop_parse_pool(self):
+        """Shut down the parse worker processes, unless they are shared with other scrapers."""
+        if self.parse_pool and self.owns_parse_pool:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+    
+    def _start_llm_batcher(self):
+        """Start the LLM batcher if llm_batch_size asks for batched calls."""
+        if self.llm_batch_size > 1 and self.llm_batcher is None:
+            self.llm_batcher = LLMBatcher(
+                self._complete_batch,
+                lambda item: self._complete_single(item[0]),
+                batch_size=self.llm_batch_size,
+                max_concurrency=self.llm_concurrency
+            )
+    
+    def _stop_llm_batcher(self):
+        """Flush and shut down the LLM batcher's threads."""
+        if self.llm_batcher:
+            self.llm_batcher.close()
+            self.llm_batcher = None
+    
+    def _parse_fetched_page(self, fetched: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Parse stage: resolve a fetched page without the LLM where possible.
+        
+        Returns (product, None) when done, or (None, pending) when the page
+        still needs the LLM stage.
+        """
+        if 'product' in fetched:
+            return fetched['product'], None
+        
+        url = fetched['url']
+        content_hash = self._content_hash(fetched['content'])
+        product_data = self._reuse_unchanged_content(url, content_hash)
+        if product_data is None:
+            product_data, page = self._structure_fetched_page(fetched)
+            if page:
+                return None, {'page': page, 'structured': product_data, 'content_hash': content_hash}
+        
+        self._remember_product(url, content_hash, product_data)
+        self._log_extraction_result(url, product_data)
+        return product_data, None
+    
+    def _llm_extract_pending(self, pending: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """LLM stage: finish a page the parse stage could not resolve."""
+        page = pending['page']
+        product_data = self.extract_product_data_with_gpt(page.html, page.url, page)
+        product_data = self._merge_structured_data(product_data, pending['structured'])
+        self._remember_product(page.url, pending['content_hash'], product_data)
+        self._log_extraction_result(page.url, product_data)
+        return product_data
+    
+    def _extract_product_page(self, fetched: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Extraction stage of scrape_product_page."""
+        try:
+            product_data, pending = self._parse_fetched_page(fetched)
+            if pending:
+                product_data = self._llm_extract_pending(pending)
+            return product_data
+                
+        except Exception as e:
+            logger.error(f"Error scraping product page {fetched['url']}: {e!r}")
+            return None
+    
+    def scrape_product_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """Scrape a single product page and extract data."""
+        fetched = self._fetch_product_page(url)
+        return self._extract_product_page(fetched) if fetched else None
+    
+    def scrape_product_parallel(self, url: str) -> Optional[Dict[str, Any]]:
+        """Wrapper for parallel scraping with thread safety."""
+        product_data = self.scrape_product_page(url)
+        if product_data:
+            with self.lock:
+                self.products.append(product_data)
+        return product_data
+    
+    def scrape_all_products(self, base_url: str) -> List[Dict[str, Any]]:
+        """Main method to scrape all products from a Shopify site with parallel processing."""
+        if self.source != 'html':
+            products = self.get_products_from_json(base_url)
+            if products is not None:
+                self.products = products
+                logger.info(f"Successfully scraped {len(products)} products")
+                self._log_extraction_stats()
+                return products
+            if self.source == 'json':
+                logger.error("products.json is disabled for this store, re-run with --source html")
+                return []
+            logger.info("Falling back to sitemap + HTML extraction")
+        
+        if self.engine == 'async':
+            return asyncio.run(self.scrape_all_products_async(base_url))
+        
+        logger.info(f"Starting scrape for: {base_url}")
+        
+        # Get all sitemap URLs
+        sitemap_urls = self.get_sitemap_urls(base_url)
+        
+        if not sitemap_urls:
+            logger.warning("No sitemap URLs found, trying direct sitemap.xml")
+            sitemap_urls = [self._sitemap_index_url(base_url)]
+        sitemap_urls = self._filter_product_sitemaps(sitemap_urls)
+        
+        products = self._run_pipeline(sitemap_urls)
+        
+        self.products = products
+        logger.info(f"Successfully scraped {len(products)} products")
+        self._log_extraction_stats()
+        return products
     
-    def _apply_fallback_fixes(self, product_data: Dict[str, Any], html_content: str, url: str) -> Dict[str, Any]:
-        """Apply fallback fixes for common extraction issues, including variants."""
-        soup = BeautifulSoup(html_content, 'html.parser')
+    def _run_pipeline(self, sitemap_urls: List[str]) -> List[Dict[str, Any]]:
+        """Crawl sitemaps through a pipeline of thread stages joined by bounded queues.
         
-        # Fix vendor if null
-        if not product_data.get('vendor'):
-            product_data['vendor'] = "Down to Earth Project LLC"
+        discovery -> dedup -> page fetch -> parse -> LLM -> output. Stages overlap,
+        so the first products are fetched while sitemaps are still downloading,
+        and a full queue blocks the stage that feeds it. Parsed pages that need
+        no LLM call skip straight to output.
+        """
+        url_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        fetch_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        page_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        llm_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        result_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        fetch_workers = self.fetch_concurrency
+        parse_workers = self.parse_workers
+        # Each LLM worker blocks on one page, so keep enough in flight to fill batches
+        llm_workers = self.llm_concurrency * max(1, self.llm_batch_size)
+        seen = set()
         
-        # Try to extract product ID from various sources
-        if not product_data.get('id') or product_data.get('id') == 'None':
-            # Look for product ID in various attributes
-            product_id = None
-            for selector in [
-                '[data-product-id]',
-                '[data-product-id]',
-                '.product-single__meta [data-product-id]',
-                'script[type="application/ld+json"]'
-            ]:
-                elements = soup.select(selector)
-                for element in elements:
-                    if element.get('data-product-id'):
-                        product_id = element.get('data-product-id')
-                        break
-                    elif element.string and '"@type":"Product"' in element.string:
-                        # Try to extract from JSON-LD
-                        try:
-                            json_data = json.loads(element.string)
-                            if isinstance(json_data, dict) and json_data.get('@type') == 'Product':
-                                if json_data.get('@id'):
-                                    product_id = json_data['@id'].split('/')[-1]
-                                    break
-                        except:
-                            pass
-            
-            if product_id:
-                product_data['id'] = product_id
-                product_data['gid'] = f"gid://shopify/Product/{product_id}"
+        sitemap_queue = queue.Queue()
+        for sitemap_url in sitemap_urls:
+            sitemap_queue.put(sitemap_url)
+        sitemap_workers = max(1, min(self.sitemap_concurrency, len(sitemap_urls)))
         
-        # Try to extract price if missing or wrong
-        if not product_data.get('price') or product_data.get('price') == 0:
-            price_selectors = [
-                '.price__regular .price-item--regular',
-                '.product__price .price-item--regular',
-                '[data-price]',
-                '.price'
-            ]
-            for selector in price_selectors:
-                price_elem = soup.select_one(selector)
-                if price_elem:
-                    price_text = price_elem.get_text().strip()
-                    price_match = re.search(r'\$?(\d+\.?\d*)', price_text)
-                    if price_match:
-                        price = float(price_match.group(1))
-                        product_data['price'] = int(price * 100)  # Convert to cents
+        def discover():
+            # Sub-sitemaps are fetched concurrently; each worker streams its own
+            while True:
+                try:
+                    sitemap_url = sitemap_queue.get_nowait()
+                except queue.Empty:
+                    break
+                for url in self.iter_product_urls_from_sitemap(sitemap_url):
+                    url_queue.put(url)
+        
+        def dedup():
+            try:
+                while True:
+                    url = url_queue.get()
+                    if url is _STOP:
                         break
+                    if url in seen:
+                        continue
+                    seen.add(url)
+                    reused = self._resume_completed(url) or self._reuse_unchanged_lastmod(url)
+                    if reused:
+                        result_queue.put(reused)
+                    else:
+                        fetch_queue.put(url)
+            finally:
+                for _ in range(fetch_workers):
+                    fetch_queue.put(_STOP)
         
-        # Try to extract images if missing
-        if not product_data.get('images') or not isinstance(product_data.get('images'), list):
-            images = []
-            img_selectors = [
-                '.product__media img',
-                '.product-single__photo img',
-                '.product__image img',
-                'img[data-src]',
-                'img[src*="cdn.shopify.com"]'
-            ]
-            for selector in img_selectors:
-                img_elements = soup.select(selector)
-                for img in img_elements:
-                    src = img.get('src') or img.get('data-src')
-                    if src and 'cdn.shopify.com' in src:
-                        if not src.startswith('http'):
-                            src = 'https:' + src if src.startswith('//') else 'https://' + src
-                        images.append(src)
-                if images:
+        def stage(in_queue: queue.Queue, out_queue: queue.Queue, work):
+            while True:
+                item = in_queue.get()
+                if item is _STOP:
                     break
-            product_data['images'] = images
+                try:
+                    result = work(item)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {work.__name__} failed: {e}")
+                    result = None
+                if result:
+                    out_queue.put(result)
         
-        # Try to extract description if missing
-        if not product_data.get('description'):
-            desc_selectors = [
-                '.product__description',
-                '.product-single__description',
-                '[data-product-description]',
-                '.rte'
-            ]
-            for selector in desc_selectors:
-                desc_elem = soup.select_one(selector)
-                if desc_elem:
-                    product_data['description'] = desc_elem.get_text().strip()
+        def parse(fetched: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            product_data, pending = self._parse_fetched_page(fetched)
+            if pending:
+                llm_queue.put(pending)
+            return product_data
+        
+        def close_after(workers: List[threading.Thread], out_queue: queue.Queue, consumers: int):
+            for worker in workers:
+                worker.join()
+            for _ in range(consumers):
+                out_queue.put(_STOP)
+        
+        def start(target, *args) -> threading.Thread:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            return thread
+        
+        self._start_parse_pool()
+        self._start_llm_batcher()
+        discoverers = [start(discover) for _ in range(sitemap_workers)]
+        start(close_after, discoverers, url_queue, 1)
+        start(dedup)
+        fetchers = [start(stage, fetch_queue, page_queue, self._fetch_product_page) for _ in range(fetch_workers)]
+        parsers = [start(stage, page_queue, result_queue, parse) for _ in range(parse_workers)]
+        llm_callers = [start(stage, llm_queue, result_queue, self._llm_extract_pending) for _ in range(llm_workers)]
+        start(close_after, fetchers, page_queue, parse_workers)
+        start(close_after, parsers, llm_queue, llm_workers)
+        start(close_after, parsers + llm_callers, result_queue, 1)
+        
+        # Output stage
+        products = []
+        try:
+            while True:
+                product_data = result_queue.get()
+                if product_data is _STOP:
                     break
+                products.append(product_data)
+                if self.checkpoint:
+                    self.checkpoint.append(product_data)
+                logger.info(f"Completed {len(products)} products ({len(seen)} discovered so far)")
+        finally:
+            self._stop_llm_batcher()
+            self._stop_parse_pool()
         
-        # Fallback for variants if missing or empty
-        if not product_data.get('variants') or not isinstance(product_data.get('variants'), list) or not product_data['variants']:
-            product_data['variants'] = self._extract_variants_from_html(soup)
+        logger.info(f"Total unique product URLs found: {len(seen)}")
+        return products
+    
+    def _log_extraction_stats(self):
+        """Log how pages were resolved."""
+        structured = self.stats['structured_pages']
+        total = structured + self.stats['llm_pages']
+        if total:
+            logger.info(f"Resolved {structured}/{total} pages from structured data without the LLM")
+        if self.stats['llm_tokens_raw']:
+            saved = self.stats['llm_tokens_raw'] - self.stats['llm_tokens_sent']
+            logger.info(f"LLM prompts: {self.stats['llm_tokens_sent']} page tokens sent, "
+                        f"{saved} saved by trimming ({saved / self.stats['llm_tokens_raw']:.0%})")
+        if self.stats['llm_batches']:
+            logger.info(f"LLM batches: {self.stats['llm_batches']} requests, "
+                        f"{self.stats['llm_batch_retries']} items retried individually")
+        if self.llm_cache:
+            logger.info(f"LLM cache: {self.llm_cache.hits} hits, {self.llm_cache.misses} misses")
+        if self.checkpoint:
+            logger.info(f"Resumed {self.stats['resumed']} products from checkpoint {self.checkpoint.path}")
+        if self.stats['retries'] or self.stats['failed_pages']:
+            logger.info(f"Retried {self.stats['retries']} requests ({self.stats['retries_exhausted']} gave up, "
+                        f"{self.retry_policy.budget} retries left in the budget); "
+                        f"{self.stats['failed_pages']} product pages failed")
+        if self.concurrency:
+            logger.info(f"Adaptive concurrency: settled at {int(self.concurrency.limit)} in-flight requests "
+                        f"after {self.concurrency.decreases} cuts")
+        if self.http_cache:
+            logger.info(f"HTTP cache: {self.stats['http_not_modified']} not modified (304), "
+                        f"{self.stats['http_downloaded']} downloaded and cached")
+        if self.crawl_state:
+            logger.info(f"Incremental crawl: {self.stats['unchanged_lastmod']} skipped by lastmod, "
+                        f"{self.stats['unchanged_content']} re-fetched but unchanged")
+        # products.json always goes through the requests session, the async engine's pages through aiohttp
+        requests_sent, opened = self.http_adapter.connection_counts()
+        opened += self.stats['http_connections_opened']
+        requests_sent += self.stats['http_connections_opened'] + self.stats['http_connections_reused']
+        if requests_sent:
+            logger.info(f"HTTP connections: {opened} opened for {requests_sent} requests "
+                        f"({1 - opened / requests_sent:.0%} reused)")
+    
+    # --- ASYNC ENGINE ---
+    
+    def _connection_trace(self) -> 'aiohttp.TraceConfig':
+        """Trace config counting new versus reused connections for the stats."""
+        async def on_create(session, context, params):
+            self._count('http_connections_opened')
         
-        return product_data
+        async def on_reuse(session, context, params):
+            self._count('http_connections_reused')
+        
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
     
-    def _extract_variants_from_html(self, soup: BeautifulSoup) -> list:
-        """Return an empty list for variants (temporarily disabled extraction)."""
-        return []
+    async def _fetch_async(self, session: 'aiohttp.ClientSession', url: str) -> Dict[str, Any]:
+        """GET a product page with the async client, revalidating it against the HTTP cache."""
+        loop = asyncio.get_running_loop()
+        # Cache lookups and writes hit SQLite (and zlib), keep them off the event loop
+        cached = await loop.run_in_executor(None, self._cached_response, url)
+        async with await self._get_async(session, url, HTTPCache.request_headers(cached)) as response:
+            if cached and response.status == 304:
+                return await loop.run_in_executor(None, self._not_modified_page, url, cached)
+            response.raise_for_status()
+            content = await response.read()
+        await loop.run_in_executor(None, self._store_response, url, response.headers, content)
+        return {'url': url, 'content': content, 'html': content.decode('utf-8', errors='replace')}
     
-    def _fallback_extraction(self, html_content: str, url: str) -> Optional[Dict[str, Any]]:
-        """Fallback extraction method when GPT fails."""
-        try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Extract basic product info
-            product_data = {
-                'url': url,
-                'vendor': 'Down to Earth Project LLC',
-                'name': '',
-                'price': 0,
-                'id': None,
-                'gid': None,
-                'description': '',
-                'images': [],
-                'availability': 'in stock',
-                'tags': [],
-                'type': None,
-                'sku': None,
-                'variant_id': None,
-                'public_title': None,
-                'weight': None,
-                'dimensions': None,
-                'tax_info': None,
-                'reviews': [],
-                'variants': []
-            }
-            
-            # Extract product name
-            name_selectors = [
-                'h1.product-single__title',
-                '.product__title h1',
-                'h1[data-product-title]',
-                'h1'
-            ]
-            for selector in name_selectors:
-                name_elem = soup.select_one(selector)
-                if name_elem:
-                    product_data['name'] = name_elem.get_text().strip()
-                    break
+    async def iter_sitemap_entries_async(self, session: 'aiohttp.ClientSession',
+                                         sitemap_url: str) -> AsyncIterator[Tuple[str, str, Optional[str]]]:
+        """Async version of iter_sitemap_entries."""
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self._cached_response, sitemap_url)
+        # Sitemaps are read as fast as the pipeline queues drain, so only bound connecting and
+        # each socket read (paused while the queues are full), not the whole download
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+        async with await self._get_async(session, sitemap_url, HTTPCache.request_headers(cached),
+                                         timeout) as response:
+            parser = SitemapStreamParser()
+            if cached and response.status == 304:
+                self._count('http_not_modified')
+                for chunk in HTTPCache.iter_body(cached['body'], SITEMAP_CHUNK_SIZE):
+                    for entry in parser.feed(chunk):
+                        yield entry
+                for entry in parser.close():
+                    yield entry
+                return
             
-            # Extract price
-            price_selectors = [
-                '.price__regular .price-item--regular',
-                '.product__price .price-item--regular',
-                '[data-price]',
-                '.price'
-            ]
-            for selector in price_selectors:
-                price_elem = soup.select_one(selector)
-                if price_elem:
-                    price_text = price_elem.get_text().strip()
-                    price_match = re.search(r'\$?(\d+\.?\d*)', price_text)
-                    if price_match:
-                        price = float(price_match.group(1))
-                        product_data['price'] = int(price * 100)
-                        break
+            response.raise_for_status()
+            cacheable = self._body_compressor(response.headers)
+            compressed = []
+            async for chunk in response.content.iter_chunked(SITEMAP_CHUNK_SIZE):
+                if cacheable:
+                    compressed.append(cacheable[0].compress(chunk))
+                for entry in parser.feed(chunk):
+                    yield entry
+            for entry in parser.close():
+                yield entry
+        if cacheable:
+            compressor, etag, last_modified = cacheable
+            await loop.run_in_executor(None, self.http_cache.put, sitemap_url, etag, last_modified,
+                                       b''.join(compressed) + compressor.flush())
+    
+    async def get_sitemap_urls_async(self, session: 'aiohttp.ClientSession', base_url: str) -> List[str]:
+        """Async version of get_sitemap_urls."""
+        sitemap_urls = []
+        try:
+            sitemap_url = self._sitemap_index_url(base_url)
+            logger.info(f"Fetching sitemap from: {sitemap_url}")
             
-            # Extract images
-            img_selectors = [
-                '.product__media img',
-                '.product-single__photo img',
-                '.product__image img',
-                'img[data-src]',
-                'img[src*="cdn.shopify.com"]'
-            ]
-            for selector in img_selectors:
-                img_elements = soup.select(selector)
-                for img in img_elements:
-                    src = img.get('src') or img.get('data-src')
-                    if src and 'cdn.shopify.com' in src:
-                        if not src.startswith('http'):
-                            src = 'https:' + src if src.startswith('//') else 'https://' + src
-                        product_data['images'].append(src)
-                if product_data['images']:
-                    break
+            async for tag, loc, _ in self.iter_sitemap_entries_async(session, sitemap_url):
+                if tag == 'sitemap':
+                    sitemap_urls.append(loc)
             
-            # Extract description
-            desc_selectors = [
-                '.product__description',
-                '.product-single__description',
-                '[data-product-description]',
-                '.rte'
-            ]
-            for selector in desc_selectors:
-                desc_elem = soup.select_one(selector)
-                if desc_elem:
-                    product_data['description'] = desc_elem.get_text().strip()
-                    break
+        except ET.ParseError as e:
+            logger.error(f"Failed to parse sitemap XML: {e}")
+        except Exception as e:
+            logger.error(f"Error fetching sitemap: {e!r}")
+        
+        logger.info(f"Found {len(sitemap_urls)} sitemap URLs")
+        return sitemap_urls
+    
+    async def iter_product_urls_from_sitemap_async(self, session: 'aiohttp.ClientSession', sitemap_url: str,
+                                                   semaphore: asyncio.Semaphore) -> AsyncIterator[str]:
+        """Async version of iter_product_urls_from_sitemap."""
+        count = 0
+        try:
+            async with semaphore:
+                logger.info(f"Fetching product URLs from: {sitemap_url}")
+                async for tag, loc, lastmod in self.iter_sitemap_entries_async(session, sitemap_url):
+                    if tag == 'url' and self._is_product_url(loc):
+                        self._remember_lastmod(loc, lastmod)
+                        count += 1
+                        yield loc
             
-            # Try to extract product ID from URL
-            url_match = re.search(r'/products/([^/?]+)', url)
-            if url_match:
-                product_data['id'] = url_match.group(1)
-                product_data['gid'] = f"gid://shopify/Product/{product_data['id']}"
+        except ET.ParseError as e:
+            logger.error(f"Failed to parse sitemap XML {sitemap_url}: {e}")
+        except Exception as e:
+            logger.error(f"Error fetching product URLs from {sitemap_url}: {e!r}")
+        
+        logger.info(f"Found {count} product URLs in {sitemap_url}")
+    
+    async def extract_product_data_with_gpt_async(self, html_content: str, url: str, semaphore: asyncio.Semaphore,
+                                                  page: Optional[ProductPage] = None) -> Optional[Dict[str, Any]]:
+        """Async version of extract_product_data_with_gpt."""
+        loop = asyncio.get_running_loop()
+        page = page or ProductPage(html_content, url, self.parser_backend)
+        try:
+            # Trimming is CPU bound and the cache lookup hits SQLite, keep both off the event loop
+            trimmed_html, cache_key, content = await loop.run_in_executor(None, self._prepare_llm_request, page)
+            product_data = None
+            if content is not None:
+                # HTML post-processing is CPU bound, keep it off the event loop
+                product_data = await loop.run_in_executor(None, self._parse_gpt_response, content, page)
             
-            # Extract variants
-            product_data['variants'] = self._extract_variants_from_html(soup)
+            if product_data is None:
+                if self.llm_batcher:
+                    content = await asyncio.wrap_future(self.llm_batcher.submit(trimmed_html, url))
+                else:
+                    async with semaphore:
+                        if self.llm_limiter:
+                            await loop.run_in_executor(None, self.llm_limiter.acquire)
+                        try:
+                            response = await self.async_openai_client.chat.completions.create(
+                                model=LLM_MODEL,
+                                messages=self._build_gpt_messages(trimmed_html),
+                                max_tokens=2000,
+                                temperature=0
+                            )
+                        finally:
+                            if self.llm_limiter:
+                                self.llm_limiter.release()
+                    content = response.choices[0].message.content
+                product_data = await loop.run_in_executor(None, self._parse_gpt_response, content, page)
+                if product_data is None:
+                    logger.warning(f"Could not extract JSON from GPT response for {url}")
+                    return await loop.run_in_executor(None, self._fallback_extraction, page)
+                if self.llm_cache:
+                    await loop.run_in_executor(None, self.llm_cache.put, cache_key, content)
             
             return product_data
             
         except Exception as e:
-            logger.error(f"Fallback extraction failed for {url}: {e}")
-            return None
+            logger.error(f"Error extracting product data with GPT for {url}: {e}")
+            return await loop.run_in_executor(None, self._fallback_extraction, page)
     
-    def scrape_product_page(self, url: str) -> Optional[Dict[str, Any]]:
-        """Scrape a single product page and extract data."""
+    async def scrape_product_json_async(self, session: 'aiohttp.ClientSession', url: str,
+                                        fetch_semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        """Async version of scrape_product_json."""
+        js_url = self._product_js_url(url)
         try:
-            logger.info(f"Scraping product page: {url}")
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # Extract product data using GPT
-            product_data = self.extract_product_data_with_gpt(response.text, url)
-            
+            async with fetch_semaphore:
+                async with await self._get_async(session, js_url) as response:
+                    if self._product_js_unavailable(url, response.status):
+                        return None
+                    response.raise_for_status()
+                    data = json.loads(await response.read())
+            return self._map_shopify_product_json(data, url, prices_in_cents=True)
+        except Exception as e:
+            logger.warning(f"Could not load product JSON for {url}: {e}")
+            return None
+    
+    async def _fetch_product_page_async(self, session: 'aiohttp.ClientSession', url: str,
+                                        fetch_semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        """Async version of _fetch_product_page."""
+        if self.product_js_enabled:
+            product_data = await self.scrape_product_json_async(session, url, fetch_semaphore)
             if product_data:
-                logger.info(f"Successfully extracted data for product: {product_data.get('name', 'Unknown')}")
-                return product_data
-            else:
-                logger.warning(f"Failed to extract product data from {url}")
+                self._remember_product(url, None, product_data)
+                return {'url': url, 'product': product_data}
+            if self.source == 'json':
                 return None
-                
+        
+        try:
+            async with fetch_semaphore:
+                logger.info(f"Scraping product page: {url}")
+                return await self._fetch_async(session, url)
+            
         except Exception as e:
-            logger.error(f"Error scraping product page {url}: {e}")
+            logger.error(f"Error scraping product page {url}: {e!r}")
+            self._count('failed_pages')
             return None
     
-    def scrape_product_parallel(self, url: str) -> Optional[Dict[str, Any]]:
-        """Wrapper for parallel scraping with thread safety."""
-        product_data = self.scrape_product_page(url)
-        if product_data:
-            with self.lock:
-                self.products.append(product_data)
+    async def _llm_extract_pending_async(self, pending: Dict[str, Any],
+                                         llm_semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        """Async version of _llm_extract_pending."""
+        page = pending['page']
+        product_data = await self.extract_product_data_with_gpt_async(page.html, page.url, llm_semaphore, page)
+        product_data = self._merge_structured_data(product_data, pending['structured'])
+        self._remember_product(page.url, pending['content_hash'], product_data)
+        self._log_extraction_result(page.url, product_data)
         return product_data
     
-    def scrape_all_products(self, base_url: str) -> List[Dict[str, Any]]:
-        """Main method to scrape all products from a Shopify site with parallel processing."""
-        logger.info(f"Starting scrape for: {base_url}")
+    async def _run_pipeline_async(self, session: 'aiohttp.ClientSession', sitemap_urls: List[str],
+                                  sitemap_semaphore: asyncio.Semaphore, fetch_semaphore: asyncio.Semaphore,
+                                  llm_semaphore: asyncio.Semaphore) -> List[Dict[str, Any]]:
+        """Async version of _run_pipeline, with coroutine workers instead of threads.
         
-        # Get all sitemap URLs
-        sitemap_urls = self.get_sitemap_urls(base_url)
+        Parsing is CPU-bound, so it runs on a thread pool of parse_workers to
+        keep the event loop free for network I/O.
+        """
+        url_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        fetch_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        page_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        llm_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        result_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        fetch_workers = self.fetch_concurrency
+        parse_workers = self.parse_workers
+        llm_workers = self.llm_concurrency * max(1, self.llm_batch_size)
+        parse_executor = ThreadPoolExecutor(max_workers=parse_workers)
+        loop = asyncio.get_running_loop()
+        self._start_parse_pool()
+        self._start_llm_batcher()
+        seen = set()
         
-        if not sitemap_urls:
-            logger.warning("No sitemap URLs found, trying direct sitemap.xml")
-            sitemap_urls = [urljoin(base_url, 'sitemap.xml')]
+        async def discover_sitemap(sitemap_url: str):
+            async for url in self.iter_product_urls_from_sitemap_async(session, sitemap_url, sitemap_semaphore):
+                await url_queue.put(url)
         
-        # Get product URLs from all sitemaps
-        all_product_urls = []
-        for sitemap_url in sitemap_urls:
-            product_urls = self.get_product_urls_from_sitemap(sitemap_url)
-            all_product_urls.extend(product_urls)
+        async def discover():
+            try:
+                await asyncio.gather(*(discover_sitemap(sitemap_url) for sitemap_url in sitemap_urls))
+            finally:
+                await url_queue.put(_STOP)
+        
+        async def dedup():
+            try:
+                while True:
+                    url = await url_queue.get()
+                    if url is _STOP:
+                        break
+                    if url in seen:
+                        continue
+                    seen.add(url)
+                    reused = self._resume_completed(url) or self._reuse_unchanged_lastmod(url)
+                    if reused:
+                        await result_queue.put(reused)
+                    else:
+                        await fetch_queue.put(url)
+            finally:
+                for _ in range(fetch_workers):
+                    await fetch_queue.put(_STOP)
+        
+        async def stage(in_queue: asyncio.Queue, out_queue: asyncio.Queue, work):
+            while True:
+                item = await in_queue.get()
+                if item is _STOP:
+                    break
+                try:
+                    result = await work(item)
+                except Exception as e:
+                    logger.error(f"Pipeline stage failed: {e}")
+                    result = None
+                if result:
+                    await out_queue.put(result)
+        
+        async def close_after(workers: list, out_queue: asyncio.Queue, consumers: int):
+            await asyncio.gather(*workers)
+            for _ in range(consumers):
+                await out_queue.put(_STOP)
+        
+        async def fetch(url: str):
+            return await self._fetch_product_page_async(session, url, fetch_semaphore)
         
-        # Remove duplicates
-        all_product_urls = list(set(all_product_urls))
-        logger.info(f"Total unique product URLs found: {len(all_product_urls)}")
+        async def parse(fetched: Dict[str, Any]):
+            product_data, pending = await loop.run_in_executor(parse_executor, self._parse_fetched_page, fetched)
+            if pending:
+                await llm_queue.put(pending)
+            return product_data
+        
+        async def llm_extract(pending: Dict[str, Any]):
+            return await self._llm_extract_pending_async(pending, llm_semaphore)
         
-        # Scrape products in parallel
+        background = [asyncio.ensure_future(discover()), asyncio.ensure_future(dedup())]
+        fetchers = [asyncio.ensure_future(stage(fetch_queue, page_queue, fetch)) for _ in range(fetch_workers)]
+        parsers = [asyncio.ensure_future(stage(page_queue, result_queue, parse)) for _ in range(parse_workers)]
+        llm_callers = [asyncio.ensure_future(stage(llm_queue, result_queue, llm_extract)) for _ in range(llm_workers)]
+        background.append(asyncio.ensure_future(close_after(fetchers, page_queue, parse_workers)))
+        background.append(asyncio.ensure_future(close_after(parsers, llm_queue, llm_workers)))
+        background.append(asyncio.ensure_future(close_after(parsers + llm_callers, result_queue, 1)))
+        
+        # Output stage
         products = []
-        completed = 0
+        try:
+            while True:
+                product_data = await result_queue.get()
+                if product_data is _STOP:
+                    break
+                products.append(product_data)
+                if self.checkpoint:
+                    self.checkpoint.append(product_data)
+                logger.info(f"Completed {len(products)} products ({len(seen)} discovered so far)")
+            await asyncio.gather(*background)
+        finally:
+            parse_executor.shutdown(wait=False)
+            self._stop_llm_batcher()
+            self._stop_parse_pool()
+        
+        logger.info(f"Total unique product URLs found: {len(seen)}")
+        return products
+    
+    async def scrape_all_products_async(self, base_url: str) -> List[Dict[str, Any]]:
+        """Scrape all products using coroutines instead of worker threads."""
+        logger.info(f"Starting async scrape for: {base_url}")
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all scraping tasks
-            future_to_url = {executor.submit(self.scrape_product_parallel, url): url for url in all_product_urls}
+        if self.async_openai_client is None:
+            self.async_openai_client = openai.AsyncOpenAI(api_key=self.openai_api_key,
+                                                          max_retries=self.retry_policy.max_retries)
+        
+        sitemap_semaphore = asyncio.Semaphore(self.sitemap_concurrency)
+        fetch_semaphore = asyncio.Semaphore(self.fetch_concurrency)
+        llm_semaphore = asyncio.Semaphore(self.llm_concurrency)
+        
+        connector = aiohttp.TCPConnector(limit=self.fetch_concurrency + self.sitemap_concurrency)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={'User-Agent': USER_AGENT},
+                                         trace_configs=[self._connection_trace()]) as session:
+            sitemap_urls = await self.get_sitemap_urls_async(session, base_url)
             
-            # Process completed tasks
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                completed += 1
-                logger.info(f"Completed {completed}/{len(all_product_urls)} products")
-                
-                try:
-                    product_data = future.result()
-                    if product_data:
-                        products.append(product_data)
-                except Exception as e:
-                    logger.error(f"Error processing {url}: {e}")
-                
-                # Add small delay to be respectful
-                time.sleep(0.2)
+            if not sitemap_urls:
+                logger.warning("No sitemap URLs found, trying direct sitemap.xml")
+                sitemap_urls = [self._sitemap_index_url(base_url)]
+            sitemap_urls = self._filter_product_sitemaps(sitemap_urls)
+            
+            products = await self._run_pipeline_async(
+                session, sitemap_urls, sitemap_semaphore, fetch_semaphore, llm_semaphore
+            )
         
         self.products = products
         logger.info(f"Successfully scraped {len(products)} products")
+        self._log_extraction_stats()
         return products
     
-    def generate_schema_org_output(self) -> str:
-        """Generate schema.org formatted output with enhanced data and variants, plus schema comment and documentation."""
-        # --- SCHEMA COMMENT AND DOCUMENTATION ---
-        schema_comment = """/*
-Purpose: This file contains a normalized, AI-friendly list of Shopify products and their variants scraped from a store.
-It is designed to make it easy for an AI agent to search, filter, and select products and variants for purchase,
-without needing to scrape the site again.
-
-Schema Template:
-{
-  'products': [
-    {
-      'product_id': str, // Unique Shopify product ID
-      'name': str, // Product name
-      'description': str, // Product description
-      'brand': str, // Brand or vendor
-      'category': str, // Product category/type
-      'tags': [str], // List of tags/keywords
-      'url': str, // Product page URL
-      'image_urls': [str], // List of product image URLs
-      'price_cents': int, // Default price in cents
-      'availability': str, // Product-level availability
-      'variants': [
-        {
-          'variant_id': str, // Unique variant ID
-          'name': str, // Variant name (e.g., 'L / Black')
-          'sku': str, // SKU
-          'price_cents': int, // Price in cents
-          'availability': str, // Variant-level availability
-          'image_url': str, // Variant image URL
-          'options': {str: str} // Option name-value pairs (e.g., {'size': 'L', 'color': 'Black'})
+    def _normalize_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        """Normalize one scraped product record to the output schema."""
+        normalized = {
+            'product_id': str(product.get('id', '')),
+            'name': product.get('name', '') or '',
+            'description': product.get('description', '') or '',
+            'brand': product.get('vendor', '') or '',
+            'category': product.get('type', '') or '',
+            'tags': product.get('tags', []) if isinstance(product.get('tags'), list) else [],
+            'url': product.get('url', '') or '',
+            'image_urls': product.get('images', []) if isinstance(product.get('images'), list) else [],
+            'price_cents': int(product.get('price', 0)) if product.get('price') else 0,
+            'availability': self._map_availability(product.get('availability', '')),
+            'variants': []
         }
-      ]
-    }
-  ]
-}
-
-Field Explanations:
-- product_id: Unique Shopify product ID (string or number as string)
-- name: Product name
-- description: Full product description
-- brand: Brand or vendor name
-- category: Product category/type (if available)
-- tags: List of tags/keywords (if available)
-- url: Product page URL
-- image_urls: List of product image URLs
-- price_cents: Default product price in cents (integer)
-- availability: Product-level availability (e.g., 'InStock', 'OutOfStock')
-- variants: List of variant objects, each with:
-    - variant_id: Unique variant ID
-    - name: Variant name (e.g., 'L / Black')
-    - sku: Stock Keeping Unit
-    - price_cents: Price in cents (integer)
-    - availability: Variant-level availability
-    - image_url: Variant image URL
-    - options: Dictionary of option name-value pairs (e.g., {'size': 'L', 'color': 'Black'})
-*/
-"""
-        # --- END SCHEMA COMMENT ---
-
-        # --- NORMALIZED DATA ---
-        products = []
-        for product in self.products:
-            # Normalize product fields
-            normalized = {
-                'product_id': str(product.get('id', '')),
-                'name': product.get('name', '') or '',
-                'description': product.get('description', '') or '',
-                'brand': product.get('vendor', '') or '',
-                'category': product.get('type', '') or '',
-                'tags': product.get('tags', []) if isinstance(product.get('tags'), list) else [],
-                'url': product.get('url', '') or '',
-                'image_urls': product.get('images', []) if isinstance(product.get('images'), list) else [],
-                'price_cents': int(product.get('price', 0)) if product.get('price') else 0,
-                'availability': self._map_availability(product.get('availability', '')),
-                'variants': []
+        # Normalize variants
+        for variant in product.get('variants', []):
+            normalized_variant = {
+                'variant_id': str(variant.get('id', '')),
+                'name': variant.get('name', '') or '',
+                'sku': variant.get('sku', '') or '',
+                'price_cents': int(variant.get('price', 0)) if variant.get('price') else 0,
+                'availability': self._map_availability(variant.get('availability', '')),
+                'image_url': variant.get('image', '') or '',
+                'options': variant.get('options', {}) if isinstance(variant.get('options', {}), dict) else {}
             }
-            # Normalize variants
-            for variant in product.get('variants', []):
-                normalized_variant = {
-                    'variant_id': str(variant.get('id', '')),
-                    'name': variant.get('name', '') or '',
-                    'sku': variant.get('sku', '') or '',
-                    'price_cents': int(variant.get('price', 0)) if variant.get('price') else 0,
-                    'availability': self._map_availability(variant.get('availability', '')),
-                    'image_url': variant.get('image', '') or '',
-                    'options': variant.get('options', {}) if isinstance(variant.get('options', {}), dict) else {}
-                }
-                normalized['variants'].append(normalized_variant)
-            products.append(normalized)
-        # --- OUTPUT ---
-        output = schema_comment + json.dumps({'products': products}, indent=2, ensure_ascii=False)
-        return output
+            normalized['variants'].append(normalized_variant)
+        return normalized
+    
+    def iter_schema_org_output(self) -> Iterator[str]:
+        """Yield the schema.org output in chunks, normalizing and serializing one product at a time.
+        
+        The concatenated chunks are identical to a single json.dumps(..., indent=2)
+        of the whole catalog, without ever holding it all as one string.
+        """
+        yield SCHEMA_COMMENT
+        if not self.products:
+            yield json.dumps({'products': []}, indent=2)
+            return
+        yield '{\n  "products": [\n'
+        for i, product in enumerate(self.products):
+            product_json = json.dumps(self._normalize_product(product), indent=2, ensure_ascii=False)
+            yield (',\n' if i else '') + '    ' + product_json.replace('\n', '\n    ')
+        yield '\n  ]\n}'
+    
+    def iter_ndjson_output(self) -> Iterator[str]:
+        """Yield one normalized product per line, as NDJSON."""
+        for product in self.products:
+            yield json.dumps(self._normalize_product(product), ensure_ascii=False) + '\n'
+    
+    def generate_schema_org_output(self) -> str:
+        """Generate schema.org formatted output with enhanced data and variants, plus schema comment and documentation."""
+        return ''.join(self.iter_schema_org_output())
     
     def _map_availability(self, availability: str) -> str:
         """Map availability text to schema.org format."""
@@ -596,40 +3002,384 @@ Field Explanations:
         else:
             return "https://schema.org/InStock"  # Default
     
-    def save_to_file(self, filename: str = "slashask.txt"):
-        """Save the schema.org output to a file."""
+    def save_to_file(self, filename: str = "slashask.txt", output_format: str = 'txt'):
+        """Stream the output to a file, replacing it atomically once complete.
+        
+        'txt' writes the commented schema.org document; 'ndjson' writes one
+        product per line plus a <name>.schema.json sidecar describing them;
+        'sqlite' writes an indexed, full-text searchable catalog database.
+        """
         try:
-            schema_output = self.generate_schema_org_output()
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(schema_output)
+            if output_format == 'sqlite':
+                write_sqlite_catalog(filename, (self._normalize_product(product) for product in self.products))
+            elif output_format == 'ndjson':
+                write_atomically(filename, self.iter_ndjson_output())
+                write_atomically(schema_sidecar_path(filename), [json.dumps(PRODUCT_JSON_SCHEMA, indent=2) + '\n'])
+            else:
+                write_atomically(filename, self.iter_schema_org_output())
             logger.info(f"Output saved to {filename}")
         except Exception as e:
             logger.error(f"Error saving to file: {e}")
 
+class ProductCatalog:
+    """Read-only query API over normalized products, with indexes built once at load.
+    
+    Products use the schema of generate_schema_org_output. Keyword terms go
+    through an inverted index, prices through a sorted array, and availability
+    and variant options through hash indexes, so each lookup is a few set
+    intersections rather than a scan of the catalog.
+    """
+    
+    TOKEN_PATTERN = re.compile(r'\w+')
+    
+    def __init__(self, products: List[Dict[str, Any]]):
+        self.products = products
+        self._terms = {}          # token -> product indexes
+        self._availability = {}   # availability key -> product indexes
+        self._options = {}        # (option name, value) -> {product index: variant indexes}
+        for i, product in enumerate(products):
+            text = ' '.join([product.get('name') or '', product.get('description') or '',
+                             product.get('brand') or '', product.get('category') or '',
+                             ' '.join(map(str, product.get('tags') or []))])
+            for token in set(self._tokenize(text)):
+                self._terms.setdefault(token, set()).add(i)
+            self._availability.setdefault(self._availability_key(product.get('availability')), set()).add(i)
+            for j, variant in enumerate(product.get('variants') or []):
+                for name, value in (variant.get('options') or {}).items():
+                    key = (name.lower(), str(value).lower())
+                    self._options.setdefault(key, {}).setdefault(i, set()).add(j)
+        self._option_products = {key: set(variants) for key, variants in self._options.items()}
+        by_price = sorted(range(len(products)), key=lambda i: products[i].get('price_cents') or 0)
+        self._price_order = by_price
+        self._prices = [products[i].get('price_cents') or 0 for i in by_price]
+    
+    @classmethod
+    def load(cls, path: str) -> 'ProductCatalog':
+        """Load a catalog written with --format txt, ndjson or sqlite."""
+        with open(path, 'rb') as f:
+            is_sqlite = f.read(16) == b'SQLite format 3\x00'
+        if is_sqlite:
+            try:
+                return cls(read_sqlite_catalog(path))
+            except sqlite3.DatabaseError as e:
+                raise ValueError(f"{path} is not a catalog written with --format sqlite: {e}") from e
+        with open(path, encoding='utf-8') as f:
+            data = f.read()
+        if path.endswith('.ndjson'):
+            return cls([json.loads(line) for line in data.splitlines() if line.strip()])
+        # Skip the /* ... */ schema comment in front of the JSON document
+        if data.startswith('/*'):
+            data = data[data.index('*/') + 2:]
+        return cls(json.loads(data)['products'])
+    
+    def _tokenize(self, text: str) -> List[str]:
+        return self.TOKEN_PATTERN.findall(text.lower())
+    
+    def _availability_key(self, availability: Optional[str]) -> str:
+        """Reduce 'https://schema.org/InStock', 'InStock' or 'in stock' to 'instock'."""
+        return (availability or '').rsplit('/', 1)[-1].replace(' ', '').replace('-', '').lower()
+    
+    def search(self, query: str = '', min_price: Optional[int] = None, max_price: Optional[int] = None,
+               availability: Optional[str] = None, options: Optional[Dict[str, str]] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return products matching every given filter, in catalog order.
+        
+        query matches products containing all of its words; prices are in
+        cents and inclusive; options (e.g. {'size': 'L', 'color': 'Black'})
+        must all hold for a single variant, and only the matching variants
+        are kept in the returned products.
+        """
+        filters = [self._terms.get(token, set()) for token in set(self._tokenize(query))]
+        if min_price is not None or max_price is not None:
+            lo = bisect.bisect_left(self._prices, min_price) if min_price is not None else 0
+            hi = bisect.bisect_right(self._prices, max_price) if max_price is not None else len(self._prices)
+            filters.append(set(self._price_order[lo:hi]))
+        if availability:
+            filters.append(self._availability.get(self._availability_key(availability), set()))
+        option_keys = [(name.lower(), str(value).lower()) for name, value in (options or {}).items()]
+        filters.extend(self._option_products.get(key, set()) for key in option_keys)
+        
+        if filters:
+            # Intersect starting from the most selective filter
+            filters.sort(key=len)
+            indexes = set(filters[0])
+            for indexes_filter in filters[1:]:
+                if not indexes:
+                    break
+                indexes &= indexes_filter
+            if option_keys:
+                # A single variant has to satisfy every option; check before applying the limit
+                matching_variants = {}
+                for i in indexes:
+                    variant_indexes = set.intersection(*(self._options[key][i] for key in option_keys))
+                    if variant_indexes:
+                        matching_variants[i] = variant_indexes
+                indexes = matching_variants.keys()
+            indexes = heapq.nsmallest(limit, indexes) if limit is not None else sorted(indexes)
+        else:
+            indexes = range(len(self.products) if limit is None else min(limit, len(self.products)))
+        
+        results = []
+        for i in indexes:
+            product = self.products[i]
+            if option_keys:
+                variants = product.get('variants') or []
+                product = dict(product, variants=[variants[j] for j in sorted(matching_variants[i])])
+            results.append(product)
+        return results
+
+def query_main(argv: List[str]):
+    """Command line entry point for `ask.py query`."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog='ask.py query', description='Search a scraped product catalog')
+    parser.add_argument('terms', nargs='*', help='Keywords that must all appear in the product text')
+    parser.add_argument('--file', default='slashask.txt',
+                        help='Catalog written with --format txt, ndjson or sqlite (default: slashask.txt)')
+    parser.add_argument('--min-price', type=int, default=None, help='Minimum price in cents')
+    parser.add_argument('--max-price', type=int, default=None, help='Maximum price in cents')
+    parser.add_argument('--availability', default=None, help='Availability, e.g. InStock, OutOfStock or PreOrder')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='Variant option to match, e.g. --option size=L --option color=Black (repeatable)')
+    parser.add_argument('--limit', type=int, default=20, help='Max products to print (default: 20)')
+    args = parser.parse_args(argv)
+    
+    options = {}
+    for option in args.option:
+        name, sep, value = option.partition('=')
+        if not sep:
+            parser.error(f"--option expects NAME=VALUE, got {option!r}")
+        options[name.strip()] = value.strip()
+    
+    try:
+        catalog = ProductCatalog.load(args.file)
+    except ValueError as e:
+        parser.error(str(e))
+    results = catalog.search(' '.join(args.terms), min_price=args.min_price, max_price=args.max_price,
+                             availability=args.availability, options=options, limit=args.limit)
+    for product in results:
+        print(json.dumps(product, ensure_ascii=False))
+
+def store_name(base_url: str) -> str:
+    """File-name-safe name for a store, used for its state, checkpoint and output files."""
+    return (urlparse(base_url).netloc or 'store').replace(':', '_')
+
+def crawl_store(args: Any, base_url: str, output: str, llm_cache: Optional[LLMCache],
+                http_cache: Optional[HTTPCache], **shared: Any) -> List[Dict[str, Any]]:
+    """Crawl one store with the command line settings and write its output file.
+    
+    shared holds ShopifyScraper arguments reused across stores (OpenAI key,
+    client, LLM limiter and parse process pool).
+    """
+    name = store_name(base_url)
+    crawl_state = None
+    if args.incremental:
+        crawl_state = CrawlState(args.state or os.path.join('.slashask_cache', 'state', f"{name}.sqlite"))
+    
+    checkpoint = CheckpointLog(
+        args.checkpoint or os.path.join('.slashask_cache', 'checkpoints', f"{name}.ndjson"),
+        resume=args.resume
+    )
+    
+    # Initialize scraper with parallel processing
+    scraper = ShopifyScraper(
+        max_workers=args.threads,
+        engine=args.engine,
+        fetch_concurrency=args.fetch_concurrency,
+        llm_concurrency=args.llm_concurrency,
+        sitemap_concurrency=args.sitemap_concurrency,
+        parse_workers=args.parse_workers,
+        parse_processes=args.parse_processes,
+        rate_limit=args.rate_limit,
+        source=args.source,
+        llm_cache=llm_cache,
+        parser=args.parser,
+        llm_token_budget=args.llm_token_budget,
+        llm_batch_size=args.llm_batch_size,
+        crawl_state=crawl_state,
+        checkpoint=checkpoint,
+        http_cache=http_cache,
+        retry_policy=RetryPolicy(max_retries=args.max_retries, budget=args.retry_budget),
+        adaptive_concurrency=args.adaptive_concurrency,
+        min_fetch_concurrency=args.min_fetch_concurrency,
+        max_fetch_concurrency=args.max_fetch_concurrency,
+        **shared
+    )
+    
+    # Scrape all products
+    try:
+        products = scraper.scrape_all_products(base_url)
+    finally:
+        checkpoint.close()
+        if crawl_state:
+            crawl_state.close()
+    
+    # Save output
+    scraper.save_to_file(output, args.format)
+    return products
+
+def crawl_stores(args: Any, llm_cache: Optional[LLMCache], http_cache: Optional[HTTPCache]):
+    """Crawl every store listed in args.stores, args.store_concurrency at a time.
+    
+    Each store keeps its own rate limit and output file; the OpenAI client,
+    a cap of args.global_llm_concurrency concurrent LLM calls and, with
+    args.parse_processes, the parse worker processes are shared.
+    """
+    # Stores share state, checkpoint and output files by store_name, so key on that
+    stores = {}
+    with open(args.stores, encoding='utf-8') as f:
+        for line in f:
+            base_url = line.strip()
+            if not base_url or base_url.startswith('#'):
+                continue
+            name = store_name(base_url)
+            if name in stores:
+                if stores[name] != base_url:
+                    logger.warning(f"Skipping {base_url}: same store as {stores[name]}")
+                continue
+            stores[name] = base_url
+    if args.state or args.checkpoint or args.output:
+        logger.warning("--state, --checkpoint and --output are per store and ignored with --stores")
+        args.state = args.checkpoint = None
+    
+    openai_api_key = os.getenv('OPENAI_API_KEY') or input("Please enter your OpenAI API key: ")
+    shared = {
+        'openai_api_key': openai_api_key,
+        'openai_client': openai.OpenAI(api_key=openai_api_key, max_retries=args.max_retries),
+        'llm_limiter': threading.BoundedSemaphore(args.global_llm_concurrency)
+    }
+    if args.parse_processes:
+        shared['parse_pool'] = start_parse_pool(args.parse_workers or os.cpu_count() or args.threads, args.parser)
+    os.makedirs(args.output_dir, exist_ok=True)
+    logger.info(f"Crawling {len(stores)} stores, {args.store_concurrency} at a time")
+    
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=args.store_concurrency) as executor:
+            futures = {
+                executor.submit(
+                    crawl_store, args, base_url,
+                    os.path.join(args.output_dir, f"{name}.{args.format}"),
+                    llm_cache, http_cache, **shared
+                ): base_url
+                for name, base_url in stores.items()
+            }
+            for future in as_completed(futures):
+                base_url = futures[future]
+                try:
+                    results[base_url] = len(future.result())
+                    logger.info(f"Finished {base_url}: {results[base_url]} products")
+                except Exception as e:
+                    logger.error(f"Crawl of {base_url} failed: {e}")
+    finally:
+        if 'parse_pool' in shared:
+            shared['parse_pool'].shutdown()
+    
+    print(f"\nScraping completed! {len(results)}/{len(stores)} stores, "
+          f"{sum(results.values())} products. Outputs saved to {args.output_dir}")
+
 def main():
     """Main function to run the scraper."""
     import sys
     import argparse
     
+    if sys.argv[1:2] == ['query']:
+        query_main(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(description='Scrape Shopify products from a store URL')
-    parser.add_argument('base_url', help='Base URL of the Shopify store')
+    parser.add_argument('base_url', nargs='?', help='Base URL of the Shopify store')
+    parser.add_argument('--stores', default=None,
+                        help='File with one store URL per line to crawl in one process, instead of base_url')
+    parser.add_argument('--store-concurrency', type=int, default=4,
+                        help='Number of stores crawled at the same time with --stores (default: 4)')
+    parser.add_argument('--global-llm-concurrency', type=int, default=16,
+                        help='Max in-flight OpenAI calls across all stores with --stores (default: 16)')
+    parser.add_argument('--output-dir', default='slashask_out',
+                        help='Directory for the per-store outputs of --stores, named <store host>.<format> '
+                             '(default: slashask_out)')
     parser.add_argument('--threads', type=int, default=8, help='Number of parallel threads (default: 8)')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='Crawl engine: worker threads or asyncio coroutines (default: threads)')
+    parser.add_argument('--fetch-concurrency', type=int, default=None,
+                        help='Max in-flight product page requests (default: --threads)')
+    parser.add_argument('--llm-concurrency', type=int, default=None,
+                        help='Max in-flight OpenAI calls (default: --threads)')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help='Number of HTML parsing workers (default: CPU count)')
+    parser.add_argument('--parse-processes', action='store_true',
+                        help='Run the parsing workers as separate processes to use all CPU cores')
+    parser.add_argument('--sitemap-concurrency', type=int, default=4,
+                        help='Number of sub-sitemaps fetched in parallel (default: 4)')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Max requests per second to the store, shared by all workers, e.g. 5 to be polite; '
+                             'by default there is no fixed limit and only 429 responses slow the crawl down')
+    parser.add_argument('--adaptive-concurrency', action='store_true',
+                        help='Adjust in-flight store requests to the store\'s latency and 429s, '
+                             'starting from --fetch-concurrency')
+    parser.add_argument('--min-fetch-concurrency', type=int, default=1,
+                        help='Lower bound for --adaptive-concurrency (default: 1)')
+    parser.add_argument('--max-fetch-concurrency', type=int, default=64,
+                        help='Upper bound for --adaptive-concurrency (default: 64)')
+    parser.add_argument('--max-retries', type=int, default=4,
+                        help='Retries per request after a 429, 5xx or connection error, with exponential backoff (default: 4)')
+    parser.add_argument('--retry-budget', type=int, default=1000,
+                        help='Max retries for the whole run, so a failing store cannot stall the crawl (default: 1000)')
+    parser.add_argument('--source', choices=['auto', 'json', 'html'], default='auto',
+                        help='Product data source: Shopify JSON endpoints, HTML + LLM, or JSON with HTML fallback (default: auto)')
+    parser.add_argument('--parser', choices=PARSER_CHOICES, default='auto',
+                        help='HTML parser for the fallback extractors; auto picks the fastest installed (default: auto)')
+    parser.add_argument('--llm-token-budget', type=int, default=LLM_TOKEN_BUDGET,
+                        help=f'Max estimated tokens of cleaned page HTML sent to the LLM (default: {LLM_TOKEN_BUDGET})')
+    parser.add_argument('--llm-batch-size', type=int, default=1,
+                        help='Number of products extracted per LLM request; 1 disables batching (default: 1)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only re-scrape products that are new or whose sitemap <lastmod> changed since the last run')
+    parser.add_argument('--state', default=None,
+                        help='Crawl state database for --incremental (default: .slashask_cache/state/<store host>.sqlite)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='txt',
+                        help='Output format: commented schema.org document, one product per line, '
+                             'or an indexed SQLite catalog (default: txt)')
+    parser.add_argument('--output', default=None,
+                        help='Output file (default: slashask.<format>)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted crawl, skipping products already in the checkpoint log')
+    parser.add_argument('--checkpoint', default=None,
+                        help='Checkpoint log of finished products (default: .slashask_cache/checkpoints/<store host>.ndjson)')
+    parser.add_argument('--http-cache', default=os.path.join('.slashask_cache', 'http.sqlite'),
+                        help='Path of the HTTP response cache used for conditional requests '
+                             '(default: .slashask_cache/http.sqlite)')
+    parser.add_argument('--http-cache-size', type=int, default=1024,
+                        help='Max size of the HTTP cache in MB; least recently used pages are evicted (default: 1024)')
+    parser.add_argument('--no-http-cache', action='store_true',
+                        help='Disable the HTTP cache and always re-download and re-extract every page')
+    parser.add_argument('--llm-cache', default=os.path.join('.slashask_cache', 'llm.sqlite'),
+                        help='Path of the persistent LLM response cache (default: .slashask_cache/llm.sqlite)')
+    parser.add_argument('--llm-cache-size', type=int, default=512,
+                        help='Max size of the LLM cache in MB before least recently used entries are evicted (default: 512)')
+    parser.add_argument('--no-llm-cache', action='store_true', help='Disable the LLM response cache')
     
     args = parser.parse_args()
+    if bool(args.base_url) == bool(args.stores):
+        parser.error("give either a store URL or --stores FILE")
     
-    base_url = args.base_url
+    llm_cache = None
+    if not args.no_llm_cache:
+        llm_cache = LLMCache(args.llm_cache, max_bytes=args.llm_cache_size * 1024 * 1024)
     
-    # Initialize scraper with parallel processing
-    scraper = ShopifyScraper(max_workers=args.threads)
+    http_cache = None
+    if not args.no_http_cache:
+        http_cache = HTTPCache(args.http_cache, max_bytes=args.http_cache_size * 1024 * 1024)
     
-    # Scrape all products
-    products = scraper.scrape_all_products(base_url)
+    if args.stores:
+        crawl_stores(args, llm_cache, http_cache)
+        return
     
-    # Save output
-    scraper.save_to_file()
+    output = args.output or f"slashask.{args.format}"
+    products = crawl_store(args, args.base_url, output, llm_cache, http_cache)
     
     print(f"\nScraping completed! Found {len(products)} products.")
-    print("Output saved to slashask.txt")
+    print(f"Output saved to {output}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -54,6 +54,219 @@ def test_scraper_import():
         print(f"✗ Failed to import ShopifyScraper: {e}")
         return False
 
+def test_parser_backends():
+    """Test that every installed HTML parser backend extracts identical fields."""
+    try:
+        from ask import ProductPage, get_parser_backend
+    except ImportError as e:
+        print(f"✗ Failed to import parser backends: {e}")
+        return False
+    
+    pages = [
+        """<html><body>
+        <div class="product-single__meta" data-product-id="123456"></div>
+        <h1 class="product-single__title"> Test Tee </h1>
+        <div class="price"><span class="price-item--regular">$19.99</span></div>
+        <div class="product__media"><img src="//cdn.shopify.com/tee.jpg"></div>
+        <div class="product__description"> Soft <b>cotton</b> tee </div>
+        </body></html>""",
+        # Inline style/script, entities and <br> inside the extracted elements
+        """<html><head><script type="application/ld+json">{"@type":"Product","productID":"789"}</script></head>
+        <body>
+        <h1 class="product-single__title">Tom &amp; Jerry&nbsp;Tee<script>window.x = 1;</script></h1>
+        <div class="price"><span class="price-item--regular"><style>.p{}</style>&euro;19,99</span></div>
+        <div class="product__description"><style>.x{}</style>Soft<br>cotton<br/>tee &lt;3
+        <script>var meta = {"a": 1};</script><template>hidden</template></div>
+        </body></html>""",
+    ]
+    fields = ['name', 'price', 'images', 'description', 'product_id']
+    
+    for html in pages:
+        results = {}
+        for name in ['html.parser', 'lxml', 'selectolax']:
+            try:
+                backend = get_parser_backend(name)
+            except ImportError:
+                print(f"- {name} parser not installed, skipping")
+                continue
+            page = ProductPage(html, 'https://example.com/products/test-tee', backend)
+            results[name] = [getattr(page, field) for field in fields]
+        
+        expected = results['html.parser']
+        for name, values in results.items():
+            if values != expected:
+                print(f"✗ {name} parser output differs from html.parser: {values} != {expected}")
+                return False
+    print(f"✓ Parser backends agree: {', '.join(results)}")
+    return True
+
+def test_catalog_search():
+    """Test that catalog option filters match a single variant before the limit is applied."""
+    try:
+        from ask import ProductCatalog
+    except ImportError as e:
+        print(f"✗ Failed to import ProductCatalog: {e}")
+        return False
+    
+    products = [
+        {'name': 'Tee One', 'price_cents': 1000, 'variants': [
+            {'sku': 'one-l-white', 'options': {'size': 'L', 'color': 'White'}},
+            {'sku': 'one-s-black', 'options': {'size': 'S', 'color': 'Black'}},
+        ]},
+        {'name': 'Tee Two', 'price_cents': 2000, 'variants': [
+            {'sku': 'two-l-black', 'options': {'size': 'L', 'color': 'Black'}},
+        ]},
+    ]
+    catalog = ProductCatalog(products)
+    options = {'size': 'L', 'color': 'Black'}
+    for limit in (None, 1):
+        results = catalog.search('tee', options=options, limit=limit)
+        if [product['name'] for product in results] != ['Tee Two']:
+            print(f"✗ Catalog search with limit={limit} returned {[p['name'] for p in results]}")
+            return False
+    if [variant['sku'] for variant in results[0]['variants']] != ['two-l-black']:
+        print(f"✗ Catalog search kept non-matching variants: {results[0]['variants']}")
+        return False
+    print("✓ Catalog search applies variant options before the limit")
+    return True
+
+def test_shopify_product_json():
+    """Test that products.json (decimal prices) and .js (cents) documents map to the same record."""
+    try:
+        from ask import ShopifyScraper
+    except ImportError as e:
+        print(f"✗ Failed to import ShopifyScraper: {e}")
+        return False
+    
+    variants = [
+        {'id': 11, 'title': 'S / Black', 'sku': 'TEE-S', 'available': True,
+         'option1': 'S', 'option2': 'Black', 'option3': None, 'featured_image': {'src': '//cdn.shopify.com/s.jpg'}},
+        {'id': 12, 'title': 'L / Black', 'sku': 'TEE-L', 'available': False,
+         'option1': 'L', 'option2': 'Black', 'option3': None, 'featured_image': None},
+    ]
+    # products.json: decimal price strings, options as objects, tags as a list
+    products_json = {
+        'id': 1, 'title': 'Tee', 'body_html': '<p>Soft <b>cotton</b></p>', 'vendor': 'Acme',
+        'product_type': 'Shirts', 'tags': ['cotton', 'summer'], 'images': [{'src': '//cdn.shopify.com/tee.jpg'}],
+        'options': [{'name': 'Size', 'position': 1}, {'name': 'Color', 'position': 2}],
+        'variants': [dict(variant, price=price) for variant, price in zip(variants, ['19.99', '21.50'])],
+    }
+    # /products/<handle>.js: prices in cents, options as names, tags as a string
+    product_js = {
+        'id': 1, 'title': 'Tee', 'description': '<p>Soft <b>cotton</b></p>', 'vendor': 'Acme',
+        'type': 'Shirts', 'tags': 'cotton, summer', 'images': ['//cdn.shopify.com/tee.jpg'],
+        'options': ['Size', 'Color'], 'price': 1999, 'available': True,
+        'variants': [dict(variant, price=price) for variant, price in zip(variants, [1999, 2150])],
+    }
+    
+    url = 'https://example.com/products/tee'
+    from_json = ShopifyScraper._map_shopify_product_json(products_json, url, prices_in_cents=False)
+    from_js = ShopifyScraper._map_shopify_product_json(product_js, url, prices_in_cents=True)
+    if from_json != from_js:
+        print(f"✗ products.json and .js records differ: {from_json} != {from_js}")
+        return False
+    
+    expected_variants = [
+        (1999, 'in stock', 'https://cdn.shopify.com/s.jpg', {'size': 'S', 'color': 'Black'}),
+        (2150, 'out of stock', '', {'size': 'L', 'color': 'Black'}),
+    ]
+    actual_variants = [(v['price'], v['availability'], v['image'], v['options']) for v in from_json['variants']]
+    if (from_json['price'], from_json['description'], from_json['tags']) != (1999, 'Soft cotton', ['cotton', 'summer']) \
+            or actual_variants != expected_variants:
+        print(f"✗ Unexpected Shopify JSON mapping: {from_json}")
+        return False
+    print("✓ Shopify JSON prices and variant options map correctly")
+    return True
+
+def test_sitemap_stream_parser():
+    """Test that the streaming sitemap parser is unaffected by namespaces, image entries and chunk boundaries."""
+    try:
+        from ask import SitemapStreamParser
+    except ImportError as e:
+        print(f"✗ Failed to import SitemapStreamParser: {e}")
+        return False
+    
+    sitemaps = [
+        (b"""<?xml version="1.0" encoding="UTF-8"?>
+        <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+                xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+          <url>
+            <loc>https://example.com/products/tee</loc>
+            <lastmod>2024-01-01T00:00:00Z</lastmod>
+            <image:image><image:loc>https://cdn.shopify.com/tee.jpg</image:loc><image:title>Tee</image:title></image:image>
+          </url>
+          <url><image:image><image:loc>https://cdn.shopify.com/orphan.jpg</image:loc></image:image></url>
+          <url><loc> https://example.com/products/hoodie </loc></url>
+        </urlset>""", [('url', 'https://example.com/products/tee', '2024-01-01T00:00:00Z'),
+                       ('url', 'https://example.com/products/hoodie', None)]),
+        # Sitemap index without a namespace
+        (b"""<sitemapindex><sitemap><loc>https://example.com/sitemap_products_1.xml?from=1&amp;to=2</loc>
+        <lastmod>2024-02-01</lastmod></sitemap></sitemapindex>""",
+         [('sitemap', 'https://example.com/sitemap_products_1.xml?from=1&to=2', '2024-02-01')]),
+    ]
+    
+    for xml, expected in sitemaps:
+        # Whole document, then chunks small enough to split tags, entities and text
+        for size in (len(xml), 7, 1):
+            parser = SitemapStreamParser()
+            entries = []
+            for start in range(0, len(xml), size):
+                entries.extend(parser.feed(xml[start:start + size]))
+            entries.extend(parser.close())
+            if entries != expected:
+                print(f"✗ Sitemap parsed in {size}-byte chunks gave {entries}, expected {expected}")
+                return False
+    print("✓ Sitemap stream parser handles namespaces, image entries and chunk boundaries")
+    return True
+
+def test_structured_data():
+    """Test that structured extraction joins ShopifyAnalytics meta variants to their JSON-LD offers."""
+    try:
+        from ask import ProductPage, ShopifyScraper
+    except ImportError as e:
+        print(f"✗ Failed to import ShopifyScraper: {e}")
+        return False
+    
+    html = """<html><head>
+    <script type="application/ld+json">{"@context": "https://schema.org", "@type": "Product", "name": "Tee",
+      "description": "Soft cotton tee", "brand": {"@type": "Brand", "name": "Acme"},
+      "image": ["//cdn.shopify.com/tee.jpg"],
+      "offers": [
+        {"@type": "Offer", "price": "19.99", "availability": "https://schema.org/InStock",
+         "url": "/products/tee?variant=11"},
+        {"@type": "Offer", "price": "21.50", "availability": "https://schema.org/OutOfStock", "sku": "TEE-L"}
+      ]}</script>
+    <script>var meta = {"product": {"id": 1, "gid": "gid://shopify/Product/1", "vendor": "Acme", "type": "Shirts",
+      "variants": [
+        {"id": 11, "price": 1999, "name": "Tee - S / Black", "public_title": "S / Black", "sku": "TEE-S"},
+        {"id": 12, "price": 2150, "name": "Tee - L / Black", "public_title": "L / Black", "sku": "TEE-L"}
+      ]}, "page": {"pageType": "product"}};</script>
+    </head><body><form>
+    <select name="options[Size]"></select><select name="options[Color]"></select>
+    </form></body></html>"""
+    
+    product = ShopifyScraper.extract_structured_data(ProductPage(html, 'https://example.com/products/tee'))
+    expected = {
+        'id': 1, 'vendor': 'Acme', 'type': 'Shirts', 'price': 1999, 'name': 'Tee',
+        'description': 'Soft cotton tee', 'availability': 'in stock', 'images': ['https://cdn.shopify.com/tee.jpg'],
+    }
+    actual = {field: product.get(field) for field in expected}
+    if actual != expected:
+        print(f"✗ Unexpected structured product fields: {actual} != {expected}")
+        return False
+    
+    # Variant 11 joins its offer by the ?variant= URL, variant 12 by SKU
+    expected_variants = [
+        (11, 'TEE-S', 1999, 'in stock', {'size': 'S', 'color': 'Black'}),
+        (12, 'TEE-L', 2150, 'out of stock', {'size': 'L', 'color': 'Black'}),
+    ]
+    actual_variants = [(v['id'], v['sku'], v['price'], v['availability'], v['options']) for v in product['variants']]
+    if actual_variants != expected_variants:
+        print(f"✗ Unexpected structured variants: {actual_variants} != {expected_variants}")
+        return False
+    print("✓ Structured data joins meta variants to JSON-LD offers")
+    return True
+
 def test_api_key():
     """Test that the API key is properly formatted."""
     api_key = os.getenv('OPENAI_API_KEY')
@@ -101,6 +314,36 @@ def main():
     
     print()
     
+    # Test parser backends
+    if not test_parser_backends():
+        all_tests_passed = False
+    
+    print()
+    
+    # Test catalog search
+    if not test_catalog_search():
+        all_tests_passed = False
+    
+    print()
+    
+    # Test Shopify JSON mapping
+    if not test_shopify_product_json():
+        all_tests_passed = False
+    
+    print()
+    
+    # Test sitemap parsing
+    if not test_sitemap_stream_parser():
+        all_tests_passed = False
+    
+    print()
+    
+    # Test structured data extraction
+    if not test_structured_data():
+        all_tests_passed = False
+    
+    print()
+    
     # Test API key
     if not test_api_key():
         all_tests_passed = False